@@ -1,12 +1,11 @@
 import pyotp
 import time
 import os
-import qrcode
-import cv2
-from PIL import Image, ImageTk
 import tkinter as tk
 from tkinter import messagebox, filedialog
 
+from totp_prewarm import prewarm
+
 class TOTPAuthenticator:
     def __init__(self, master):
         self.master = master
@@ -61,17 +60,19 @@ class TOTPAuthenticator:
     def scan_qr_code(self):
         image_path = filedialog.askopenfilename(title="Select QR Code Image", filetypes=[("Image Files", "*.png;*.jpg;*.jpeg")])
         if image_path:
-            secret = self.scan_qr_code_image(image_path)
-            if secret:
-                self.secret = secret
+            uri = self.scan_qr_code_image(image_path)
+            if uri:
+                self.secret = uri.secret
                 self.secret_entry.delete(0, tk.END)
                 self.secret_entry.insert(0, self.secret)
-                self.totp = pyotp.TOTP(self.secret)
+                self.totp = uri.totp()
                 #messagebox.showinfo("Secret Extracted", f"Extracted secret from QR code: {self.secret}")
             else:
                 messagebox.showerror("Error", "Failed to extract the secret from the QR code.")
 
     def generate_qr_code(self, secret, account_name, issuer_name):
+        import qrcode
+
         uri = pyotp.totp.TOTP(secret).provisioning_uri(name=account_name, issuer_name=issuer_name)
         qr = qrcode.make(uri)
         file_path = f"{account_name}_qrcode.png"
@@ -80,13 +81,12 @@ class TOTPAuthenticator:
 
     def scan_qr_code_image(self, image_path):
         try:
-            img = cv2.imread(image_path)
-            detector = cv2.QRCodeDetector()
-            data, _, _ = detector.detectAndDecode(img)
-            if data:
-                secret = data.split("secret=")[1].split("&")[0]
-                return secret
-            messagebox.showwarning("No QR Code", "No QR code detected in the image!")
+            # OpenCV is only imported once a QR code is actually needed
+            from totp_qr_ingest import read_otpauth_file
+
+            return read_otpauth_file(image_path)
+        except ValueError as e:
+            messagebox.showwarning("No QR Code", f"No usable QR code in the image: {e}")
         except Exception as e:
             messagebox.showerror("Error", f"Error reading QR code: {e}")
         return None
@@ -94,7 +94,7 @@ class TOTPAuthenticator:
     def update_code(self):
         if self.totp:
             current_code = self.totp.now()
-            remaining_time = 30 - (int(time.time()) % 30)
+            remaining_time = self.totp.interval - (int(time.time()) % self.totp.interval)
             self.code_label.config(text=f"Current Code: {current_code}")
             self.timer_label.config(text=f"Expires in: {remaining_time}s")
         self.master.after(1000, self.update_code)  # Update every second
@@ -102,4 +102,5 @@ class TOTPAuthenticator:
 if __name__ == "__main__":
     root = tk.Tk()
     app = TOTPAuthenticator(root)
+    root.after_idle(prewarm, "qrcode", "totp_qr_ingest")
     root.mainloop()
\ No newline at end of file
@@ -0,0 +1,80 @@
+import pyotp
+
+from totp_cache import VerificationCache, first_match
+from totp_store import make_credential
+
+NOW = 1_700_000_010
+
+
+def test_first_match_computes_codes_lazily():
+    calls = []
+
+    def code_at(offset):
+        calls.append(offset)
+        return {0: "111111", -1: "222222", 1: "333333"}[offset]
+
+    assert first_match("222222", (0, -1, 1), code_at) == -1
+    assert calls == [0, -1]
+    assert first_match(222222, (0, -1, 1), code_at) == -1
+    assert first_match("999999", (0, -1, 1), code_at) is None
+
+
+def test_match_returns_matched_step():
+    credential = make_credential(pyotp.random_base32())
+    totp = credential.totp()
+    cache = VerificationCache()
+    step = NOW // 30
+
+    assert cache.match("alice", credential, totp.at(NOW), NOW) == step
+    assert cache.match("alice", credential, totp.at(NOW - 30), NOW) == step - 1
+    assert cache.match("alice", credential, totp.at(NOW + 30), NOW) == step + 1
+    assert cache.match("alice", credential, totp.at(NOW + 90), NOW) is None
+
+
+def test_repeated_match_in_same_step_is_a_hit():
+    credential = make_credential(pyotp.random_base32())
+    cache = VerificationCache()
+    code = credential.totp().at(NOW)
+
+    cache.match("alice", credential, code, NOW)
+    misses = cache.misses
+    cache.match("alice", credential, code, NOW + 1)
+    assert cache.misses == misses
+    assert cache.hits == 1
+
+
+def test_credential_change_resets_entry():
+    old = make_credential(pyotp.random_base32())
+    new = make_credential(pyotp.random_base32(), period=60)
+    cache = VerificationCache()
+
+    assert cache.match("alice", old, old.totp().at(NOW), NOW) == NOW // 30
+    assert cache.match("alice", new, old.totp().at(NOW), NOW) is None
+    assert cache.match("alice", new, new.totp().at(NOW), NOW) == NOW // 60
+
+
+def test_step_rollover_recomputes_codes():
+    credential = make_credential(pyotp.random_base32())
+    cache = VerificationCache()
+    later = NOW + 30
+
+    cache.match("alice", credential, credential.totp().at(NOW), NOW)
+    assert cache.match("alice", credential, credential.totp().at(later), later) == later // 30
+
+
+def test_invalidate_and_lru_eviction():
+    credential = make_credential(pyotp.random_base32())
+    code = credential.totp().at(NOW)
+    cache = VerificationCache(max_size=2)
+
+    for user in ("a", "b", "c"):
+        cache.match(user, credential, code, NOW)
+    assert cache.stats()["size"] == 2
+
+    # "a" was evicted, so matching it again computes its code afresh
+    misses = cache.misses
+    cache.match("a", credential, code, NOW)
+    assert cache.misses == misses + 1
+
+    cache.invalidate("a")
+    assert cache.stats()["size"] == 1
@@ -0,0 +1,62 @@
+from totp_drift import DriftTracker, candidate_offsets
+
+
+def test_candidate_offsets_put_prediction_first():
+    assert candidate_offsets(0) == [0, -1, 1]
+    assert candidate_offsets(3) == [3, 2, 4, -1, 0, 1]
+    assert candidate_offsets(-1) == [-1, -2, 0, 1]
+
+
+def test_single_jitter_does_not_move_prediction():
+    tracker = DriftTracker()
+    tracker.record("alice", 1)
+    assert tracker.estimate("alice") == 0.5
+    assert tracker.predict("alice") == 0
+    tracker.record("alice", -1)
+    assert tracker.predict("alice") == 0
+
+
+def test_follows_a_drifting_device():
+    tracker = DriftTracker()
+    predictions = []
+    for _ in range(3):
+        tracker.record("alice", 2)
+        predictions.append(tracker.predict("alice"))
+    assert predictions == [1, 1, 2]
+
+    for _ in range(3):
+        tracker.record("bob", -2)
+    assert tracker.predict("bob") == -2
+
+
+def test_offsets_are_clamped_to_max_drift():
+    tracker = DriftTracker(max_drift=3)
+    tracker.record("alice", 100)
+    assert tracker.estimate("alice") == 1.5
+    for _ in range(20):
+        tracker.record("alice", 100)
+        tracker.record("bob", -100)
+    assert tracker.predict("alice") == 3
+    assert tracker.predict("bob") == -3
+
+
+def test_settled_users_are_not_stored():
+    tracker = DriftTracker()
+    tracker.record("alice", 1)
+    assert len(tracker) == 1
+    for _ in range(5):
+        tracker.record("alice", 0)
+    assert tracker.estimate("alice") == 0
+    assert len(tracker) == 0
+
+
+def test_max_users_and_forget():
+    tracker = DriftTracker(max_users=2)
+    for user in ("a", "b", "c"):
+        tracker.record(user, 2)
+    assert len(tracker) == 2
+    assert tracker.predict("a") == 0
+
+    tracker.forget("b")
+    assert tracker.predict("b") == 0
+    assert len(tracker) == 1
@@ -0,0 +1,70 @@
+from totp_replay import ReplayGuard
+
+
+def test_rejects_replayed_and_older_steps():
+    guard = ReplayGuard(capacity=64)
+    assert guard.check_and_record("alice", 1000)
+    assert not guard.check_and_record("alice", 1000)
+    assert not guard.check_and_record("alice", 999)
+    assert guard.check_and_record("alice", 1001)
+    assert guard.last_step("alice") == 1001
+
+
+def test_users_are_independent():
+    guard = ReplayGuard(capacity=64)
+    assert guard.check_and_record("alice", 1000)
+    assert guard.check_and_record("bob", 1000)
+    assert guard.last_step("carol") is None
+
+
+def test_forget_after_credential_change():
+    # A longer period gives much smaller step numbers for the same time
+    guard = ReplayGuard(capacity=64)
+    now = 1_700_000_000
+    assert guard.check_and_record("alice", now // 30)
+    guard.forget("alice")
+    assert guard.check_and_record("alice", now // 60)
+    assert not guard.check_and_record("alice", now // 60)
+
+
+def test_forget_keeps_probe_runs_intact():
+    guard = ReplayGuard(capacity=4, max_probe=4)
+    for i, user in enumerate(["a", "b", "c"]):
+        assert guard.check_and_record(user, 100 + i)
+    for user in ["a", "b", "c"]:
+        guard.forget(user)
+    # Every user is still found, so a second forget or a record hits the same slot
+    for i, user in enumerate(["a", "b", "c"]):
+        assert guard.last_step(user) == 0
+        assert guard.check_and_record(user, 200 + i)
+        assert not guard.check_and_record(user, 200 + i)
+
+
+def test_full_probe_run_evicts_oldest_step():
+    guard = ReplayGuard(capacity=4, max_probe=4)
+    for i, user in enumerate(["a", "b", "c", "d"]):
+        assert guard.check_and_record(user, 100 + i)
+
+    assert guard.check_and_record("e", 200)
+    # "a" held the oldest step, so its slot was reused and its history is gone
+    assert guard.last_step("a") is None
+    assert guard.check_and_record("a", 100)
+    assert not guard.check_and_record("c", 102)
+    assert not guard.check_and_record("d", 103)
+    assert not guard.check_and_record("e", 200)
+
+
+def test_file_backed_table_is_shared(tmp_path):
+    path = str(tmp_path / "replay.bin")
+    first = ReplayGuard(capacity=64, path=path)
+    second = ReplayGuard(capacity=1024, path=path)
+    try:
+        # The existing table keeps its size
+        assert second.capacity == 64
+        assert first.check_and_record("alice", 1000)
+        assert not second.check_and_record("alice", 1000)
+        second.forget("alice")
+        assert first.check_and_record("alice", 1000)
+    finally:
+        first.close()
+        second.close()
@@ -0,0 +1,152 @@
+"""Asyncio-native variant of the TOTP verification server
+
+Serves the same /register and /verify contract as totp_verification_server,
+but on an event loop, so one process can hold many keep-alive connections:
+
+    uvicorn totp_asgi_server:app --host 0.0.0.0 --port 5000
+    hypercorn totp_asgi_server:app --bind 0.0.0.0:5000 --certfile cert.pem --keyfile key.pem
+
+hypercorn negotiates HTTP/2 over TLS. Store, SQLite rate-limiter and
+file-backed replay guard calls run in a thread pool so slow I/O and
+cross-process locks never block the loop.
+"""
+import asyncio
+import json
+import os
+import time
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from totp_audit import create_audit_log
+from totp_cache import VerificationCache
+from totp_drift import candidate_offsets, create_drift_tracker
+from totp_rate_limiter import SQLiteRateLimiter, create_limiter
+from totp_replay import create_replay_guard
+from totp_store import AsyncSecretStore, create_store, make_credential
+
+secret_store = AsyncSecretStore(create_store())
+verification_cache = VerificationCache()
+limiter = create_limiter()
+replay_guard = create_replay_guard()
+drift_tracker = create_drift_tracker()
+audit_log = create_audit_log()
+
+
+async def _limit_exceeded(key, max_requests, window):
+    """Return True if the request for key is over its limit"""
+    if isinstance(limiter, SQLiteRateLimiter):
+        allowed = await asyncio.to_thread(limiter.hit, key, max_requests, window)
+    else:
+        allowed = limiter.hit(key, max_requests, window)
+    return not allowed
+
+
+async def _replay_guard(method, *args):
+    """Call a replay guard method, off the loop when it takes a cross-process file lock"""
+    if replay_guard.path:
+        return await asyncio.to_thread(method, *args)
+    return method(*args)
+
+
+async def _read_json(request):
+    """Parse the request body as a JSON object"""
+    data = json.loads(await request.body())
+    if not isinstance(data, dict):
+        raise ValueError("Expected a JSON object")
+    return data
+
+
+def _respond(request, route, outcome, body, status_code, user_id=None, offset=None):
+    """Build the JSON response and queue the request's audit event"""
+    if audit_log is not None:
+        audit_log.record(route, outcome, user_id=user_id, client=request.client.host, offset=offset,
+                         duration=time.perf_counter() - request.state.start)
+    return JSONResponse(body, status_code=status_code)
+
+
+async def register(request):
+    """Register a new TOTP secret"""
+    request.state.start = time.perf_counter()
+    if await _limit_exceeded(f"register:ip:{request.client.host}", 3, 60):
+        return _respond(request, 'register', 'rate_limited', {"error": "Rate limit exceeded"}, 429)
+
+    try:
+        data = await _read_json(request)
+        user_id = data.get('user_id')
+        secret = data.get('secret')
+
+        if not user_id or not secret:
+            return _respond(request, 'register', 'missing_fields', {"error": "Missing required fields"}, 400, user_id)
+
+        # Validate secret and optional algorithm/digits/period
+        try:
+            credential = make_credential(secret, data.get('algorithm'), data.get('digits'), data.get('period'))
+        except Exception:
+            return _respond(request, 'register', 'invalid_secret', {"error": "Invalid secret"}, 400, user_id)
+
+        await secret_store.put(user_id, credential)
+        verification_cache.invalidate(user_id)
+        drift_tracker.forget(user_id)
+        await _replay_guard(replay_guard.forget, user_id)
+
+        return _respond(request, 'register', 'success', {"message": "Registration successful"}, 201, user_id)
+
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+
+async def verify(request):
+    """Verify a TOTP code"""
+    request.state.start = time.perf_counter()
+    if await _limit_exceeded(f"verify:ip:{request.client.host}", 3, 60):
+        return _respond(request, 'verify', 'rate_limited', {"error": "Rate limit exceeded"}, 429)
+
+    try:
+        data = await _read_json(request)
+        user_id = data.get('user_id')
+        code = data.get('code')
+
+        if user_id and await _limit_exceeded(f"verify:user:{user_id}", 5, 60):
+            return _respond(request, 'verify', 'rate_limited', {"error": "Rate limit exceeded"}, 429, user_id)
+
+        if not user_id or not code:
+            return _respond(request, 'verify', 'missing_fields', {"error": "Missing required fields"}, 400, user_id)
+
+        credential = await secret_store.get(user_id)
+        if not credential:
+            return _respond(request, 'verify', 'unknown_user', {"error": "User not found"}, 404, user_id)
+
+        # Try the step predicted by the user's drift first, then widen to ±1 around it and now
+        now = time.time()
+        offsets = candidate_offsets(drift_tracker.predict(user_id))
+        step = verification_cache.match(user_id, credential, code, now, offsets)
+        if step is not None and not await _replay_guard(replay_guard.check_and_record, user_id, step):
+            return _respond(request, 'verify', 'replayed', {"error": "Code already used"}, 401, user_id)
+        if step is not None:
+            offset = step - int(now // credential.period)
+            drift_tracker.record(user_id, offset)
+            return _respond(request, 'verify', 'success', {"message": "Code verified successfully"}, 200, user_id, offset)
+        else:
+            return _respond(request, 'verify', 'invalid_code', {"error": "Invalid code"}, 401, user_id)
+
+    except Exception as e:
+        return _respond(request, 'verify', 'error', {"error": str(e)}, 400)
+
+
+app = Starlette(routes=[
+    Route('/register', register, methods=['POST']),
+    Route('/verify', verify, methods=['POST']),
+])
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(
+        app,
+        host='0.0.0.0',
+        port=5000,
+        ssl_certfile=os.environ.get('TOTP_SSL_CERTFILE'),
+        ssl_keyfile=os.environ.get('TOTP_SSL_KEYFILE'),
+    )
@@ -0,0 +1,301 @@
+"""Asynchronous audit log of register and verify outcomes
+
+    audit = AuditLog("audit")
+    audit.record("verify", "success", user_id="alice", client="10.0.0.7", offset=0, duration=0.0012)
+
+    python totp_audit.py query audit --user alice --since 2024-05-01
+    python totp_audit.py query audit --outcome replayed --count
+
+record() only appends a tuple to a deque, which is atomic under the GIL, so
+the request path never takes a lock or touches the disk. A background
+writer drains the queue in batches, formats compact NDJSON and appends it
+to the current segment, flushing every flush_interval seconds. Segments
+are named after their first event's time and the writing process
+(audit-<epoch ms>-<pid>.ndjson), so several workers can share a directory.
+They are rotated by size or age, gzip-compressed once closed, and pruned to
+keep_files.
+
+Backpressure: above sample_above queued events only every sample_every-th
+event is kept, and at max_queue new events are dropped. Both are counted
+(approximately, since the counters are not locked) and exported as metrics.
+
+Each line holds ts, event and outcome, plus user, offset, client and ms
+(time spent in the request) when known, and any extra fields.
+"""
+import argparse
+import atexit
+import gzip
+import heapq
+import itertools
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+
+SEGMENT_PREFIX = "audit-"
+
+
+def _parse_segment_name(name):
+    """Return (start_ts, pid) from an audit-<epoch ms>-<pid>.ndjson[.gz] name"""
+    start, _, pid = name[len(SEGMENT_PREFIX):].split(".", 1)[0].partition("-")
+    return int(start) / 1000, int(pid)
+
+
+def _writer_alive(name):
+    try:
+        os.kill(_parse_segment_name(name)[1], 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class AuditLog:
+    """Batched, non-blocking NDJSON audit writer"""
+
+    def __init__(self, directory, max_queue=100000, sample_above=None, sample_every=10, batch_size=1000,
+                 flush_interval=0.5, rotate_bytes=64 << 20, rotate_seconds=3600, keep_files=None):
+        self.directory = directory
+        self.max_queue = max_queue
+        self.sample_above = sample_above
+        self.sample_every = sample_every
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.keep_files = keep_files
+        self.dropped = 0
+        self.sampled_out = 0
+        self.written = 0
+
+        self._queue = deque()
+        self._sequence = itertools.count()
+        self._file = None
+        self._path = None
+        self._opened_at = 0.0
+        self._stop = threading.Event()
+
+        os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="totp-audit-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def record(self, event, outcome, user_id=None, client=None, offset=None, duration=None, **extra):
+        """Queue an event and return True, or False if backpressure shed it; never blocks"""
+        depth = len(self._queue)
+        if depth >= self.max_queue:
+            self.dropped += 1
+            return False
+        if self.sample_above is not None and depth >= self.sample_above and next(self._sequence) % self.sample_every:
+            self.sampled_out += 1
+            return False
+        self._queue.append((time.time(), event, outcome, user_id, offset, client, duration, extra))
+        return True
+
+    def __len__(self):
+        return len(self._queue)
+
+    def stats(self):
+        return {"queued": len(self._queue), "written": self.written, "dropped": self.dropped,
+                "sampled_out": self.sampled_out}
+
+    @staticmethod
+    def _format(item):
+        ts, event, outcome, user_id, offset, client, duration, extra = item
+        record = {"ts": round(ts, 3), "event": event, "outcome": outcome}
+        if user_id is not None:
+            record["user"] = user_id
+        if offset is not None:
+            record["offset"] = offset
+        if client is not None:
+            record["client"] = client
+        if duration is not None:
+            record["ms"] = round(duration * 1000, 3)
+        record.update(extra)
+        return json.dumps(record, separators=(",", ":"), default=str)
+
+    def _run(self):
+        # Segments left uncompressed by a process that has since exited are finished first
+        for name in os.listdir(self.directory):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(".ndjson") and not _writer_alive(name):
+                self._compress(os.path.join(self.directory, name))
+        while True:
+            stopping = self._stop.wait(self.flush_interval)
+            self._drain()
+            if stopping:
+                break
+        self._rotate()
+
+    def _drain(self):
+        wrote = False
+        while self._queue:
+            batch = []
+            while self._queue and len(batch) < self.batch_size:
+                batch.append(self._queue.popleft())
+            if self._file is None or self._due_for_rotation():
+                self._rotate()
+                self._open(batch[0][0])
+            data = "\n".join(map(self._format, batch)) + "\n"
+            self._file.write(data.encode("utf-8"))
+            self.written += len(batch)
+            wrote = True
+        if wrote:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        elif self._file is not None and self._due_for_rotation():
+            self._rotate()
+
+    def _due_for_rotation(self):
+        return self._file.tell() >= self.rotate_bytes or time.time() - self._opened_at >= self.rotate_seconds
+
+    def _open(self, first_ts):
+        name = f"{SEGMENT_PREFIX}{int(first_ts * 1000):013d}-{os.getpid()}.ndjson"
+        self._path = os.path.join(self.directory, name)
+        self._file = open(self._path, "ab")
+        self._opened_at = time.time()
+
+    def _rotate(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        self._compress(self._path)
+        self._prune()
+
+    def _compress(self, path):
+        tmp_path = f"{path}.gz.tmp"
+        with open(path, "rb") as src, gzip.open(tmp_path, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(tmp_path, f"{path}.gz")
+        os.remove(path)
+
+    def _prune(self):
+        if self.keep_files is None:
+            return
+        compressed = sorted(name for name in os.listdir(self.directory)
+                            if name.startswith(SEGMENT_PREFIX) and name.endswith(".ndjson.gz"))
+        for name in compressed[:max(len(compressed) - self.keep_files, 0)]:
+            os.remove(os.path.join(self.directory, name))
+
+    def close(self):
+        """Write out everything queued and stop the writer"""
+        if not self._stop.is_set():
+            self._stop.set()
+            self._thread.join()
+
+
+def create_audit_log(directory=None):
+    """Build the audit log, or return None when auditing is not configured
+
+    Settings fall back to TOTP_AUDIT_DIR, TOTP_AUDIT_MAX_QUEUE,
+    TOTP_AUDIT_SAMPLE_ABOVE, TOTP_AUDIT_ROTATE_BYTES and TOTP_AUDIT_KEEP_FILES.
+    """
+    directory = directory or os.environ.get("TOTP_AUDIT_DIR")
+    if not directory:
+        return None
+    env = os.environ.get
+    return AuditLog(
+        directory,
+        max_queue=int(env("TOTP_AUDIT_MAX_QUEUE", "100000")),
+        sample_above=int(env("TOTP_AUDIT_SAMPLE_ABOVE")) if env("TOTP_AUDIT_SAMPLE_ABOVE") else None,
+        rotate_bytes=int(env("TOTP_AUDIT_ROTATE_BYTES", str(64 << 20))),
+        keep_files=int(env("TOTP_AUDIT_KEEP_FILES")) if env("TOTP_AUDIT_KEEP_FILES") else None,
+    )
+
+
+def _segments(directory):
+    """Return {pid: [(start_ts, path)]} in time order, preferring the compressed copy of a segment"""
+    segments = {}
+    for name in os.listdir(directory):
+        if not name.startswith(SEGMENT_PREFIX) or not name.endswith((".ndjson", ".ndjson.gz")):
+            continue
+        key = _parse_segment_name(name)
+        if key not in segments or name.endswith(".gz"):
+            segments[key] = os.path.join(directory, name)
+    by_writer = {}
+    for (start, pid), path in sorted(segments.items()):
+        by_writer.setdefault(pid, []).append((start, path))
+    return by_writer
+
+
+def _read_segment(path):
+    try:
+        f = gzip.open(path, "rt", encoding="utf-8") if path.endswith(".gz") else open(path, encoding="utf-8")
+    except FileNotFoundError:
+        # Compressed between listing and opening
+        f = gzip.open(f"{path}.gz", "rt", encoding="utf-8")
+    with f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # A line the writer is still appending
+                continue
+
+
+def _iter_writer(segments, since, until):
+    for index, (start, path) in enumerate(segments):
+        # A writer's segment ends where its next one starts
+        if since is not None and index + 1 < len(segments) and segments[index + 1][0] <= since:
+            continue
+        if until is not None and start > until:
+            break
+        for event in _read_segment(path):
+            if (since is None or event["ts"] >= since) and (until is None or event["ts"] <= until):
+                yield event
+
+
+def iter_events(directory, since=None, until=None):
+    """Yield audit events in time order, streaming one segment per writer at a time
+
+    Segments that end before since, or start after until, are never opened.
+    """
+    writers = [_iter_writer(segments, since, until) for segments in _segments(directory).values()]
+    return heapq.merge(*writers, key=lambda event: event["ts"])
+
+
+def _parse_time(value):
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query the TOTP audit log")
+    commands = parser.add_subparsers(dest="command", required=True)
+    query = commands.add_parser("query", help="stream matching events as NDJSON")
+    query.add_argument("directory", help="audit directory (TOTP_AUDIT_DIR)")
+    query.add_argument("--since", type=_parse_time, help="epoch seconds or ISO 8601 time")
+    query.add_argument("--until", type=_parse_time, help="epoch seconds or ISO 8601 time")
+    query.add_argument("--event", help="e.g. register, verify, verify_batch")
+    query.add_argument("--outcome", help="e.g. success, invalid_code, replayed")
+    query.add_argument("--user")
+    query.add_argument("--client")
+    query.add_argument("--limit", type=int)
+    query.add_argument("--count", action="store_true", help="print counts per event and outcome instead")
+    args = parser.parse_args(argv)
+
+    filters = {key: value for key, value in (("event", args.event), ("outcome", args.outcome),
+                                             ("user", args.user), ("client", args.client)) if value is not None}
+    matches = (event for event in iter_events(args.directory, args.since, args.until)
+               if all(event.get(key) == value for key, value in filters.items()))
+    if args.limit is not None:
+        matches = itertools.islice(matches, args.limit)
+
+    if args.count:
+        counts = Counter((event["event"], event["outcome"]) for event in matches)
+        for (event, outcome), count in sorted(counts.items()):
+            print(f"{event}\t{outcome}\t{count}")
+    else:
+        for event in matches:
+            sys.stdout.write(json.dumps(event, separators=(",", ":")) + "\n")
+
+
+if __name__ == "__main__":
+    main()
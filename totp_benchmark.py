@@ -0,0 +1,281 @@
+"""Local benchmarks for the TOTP verification path
+
+    python totp_benchmark.py codes --iterations 20000
+    python totp_benchmark.py http --requests 5000 --concurrency 8
+    python totp_benchmark.py ratelimit --clients 100 1000 10000 100000
+    python totp_benchmark.py startup --runs 5 --max-startup-ms 500
+    python totp_benchmark.py all --output results.json
+
+Every benchmark reports p50/p95/p99 latency and requests per second. Results
+are printed and, with --output, saved as JSON for comparison across versions.
+The startup suite exits non-zero if a desktop app imports OpenCV, pyzbar,
+qrcode or PIL before its window is shown, or starts slower than
+--max-startup-ms.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pyotp
+
+
+def summarize(name, latencies, elapsed, **extra):
+    """Build a result record from per-operation latencies in seconds"""
+    ordered = sorted(latencies)
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] * 1e6
+
+    result = {
+        "name": name,
+        "operations": len(ordered),
+        "ops_per_sec": len(ordered) / elapsed if elapsed else 0.0,
+        "p50_us": percentile(50),
+        "p95_us": percentile(95),
+        "p99_us": percentile(99),
+    }
+    result.update(extra)
+    return result
+
+
+def timed_loop(func, iterations):
+    """Call func(i) iterations times and return (latencies, elapsed)"""
+    latencies = []
+    clock = time.perf_counter
+    start = clock()
+    for i in range(iterations):
+        t0 = clock()
+        func(i)
+        latencies.append(clock() - t0)
+    return latencies, clock() - start
+
+
+def bench_codes(iterations):
+    """Raw pyotp generation and verification, as used by verify()"""
+    secret = pyotp.random_base32()
+    totp = pyotp.TOTP(secret)
+    code = totp.now()
+    results = []
+
+    latencies, elapsed = timed_loop(lambda i: pyotp.TOTP(secret).now(), iterations)
+    results.append(summarize("codes.generate", latencies, elapsed))
+
+    latencies, elapsed = timed_loop(lambda i: pyotp.TOTP(secret).verify(code, valid_window=1), iterations)
+    results.append(summarize("codes.verify_window1", latencies, elapsed))
+
+    from totp_cache import VerificationCache
+    from totp_store import Credential
+
+    cache = VerificationCache()
+    credential = Credential(secret)
+    latencies, elapsed = timed_loop(lambda i: cache.match("bench", credential, code), iterations)
+    results.append(summarize("codes.verify_cached", latencies, elapsed, cache=cache.stats()))
+    return results
+
+
+def bench_http(requests, concurrency):
+    """Flask test-client throughput of /register and /verify"""
+    # Keep the benchmark self-contained unless a store is configured explicitly
+    os.environ.setdefault("TOTP_STORE_PATH", ":memory:")
+    import totp_verification_server as server
+
+    secrets = [pyotp.random_base32() for _ in range(requests)]
+
+    def run(route, make_body):
+        def one(i):
+            # A distinct client address and user per request keeps the rate
+            # limiter from turning the benchmark into a 429 benchmark
+            client = server.app.test_client()
+            body = make_body(i)
+            t0 = time.perf_counter()
+            response = client.post(route, json=body, environ_base={"REMOTE_ADDR": f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}"})
+            return time.perf_counter() - t0, response.status_code
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            outcomes = list(pool.map(one, range(requests)))
+        elapsed = time.perf_counter() - start
+
+        statuses = {}
+        for _, status in outcomes:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        return summarize(f"http{route}", [latency for latency, _ in outcomes], elapsed,
+                         concurrency=concurrency, statuses=statuses)
+
+    results = [run("/register", lambda i: {"user_id": f"bench-{i}", "secret": secrets[i]})]
+    results.append(run("/verify", lambda i: {"user_id": f"bench-{i}", "code": pyotp.TOTP(secrets[i]).now()}))
+    return results
+
+
+def bench_ratelimit(client_counts, iterations):
+    """Cost of the rate_limit decorator, and of the limiter alone, as the number of distinct clients grows"""
+    os.environ.setdefault("TOTP_STORE_PATH", ":memory:")
+    import totp_verification_server as server
+    from totp_rate_limiter import SlidingWindowLimiter
+
+    # Limits high enough that every call takes the allowed path
+    @server.rate_limit(max_requests=iterations + 1, user_max_requests=iterations + 1)
+    def verify():
+        return None
+
+    def address(i):
+        return f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}"
+
+    results = []
+    saved_limiter = server.limiter
+    try:
+        for clients in client_counts:
+            limiter = server.limiter = SlidingWindowLimiter()
+            for i in range(clients):
+                limiter.hit(f"verify:ip:{address(i)}", iterations + 1, 60)
+                limiter.hit(f"verify:user:bench-{i}", iterations + 1, 60)
+
+            # The request context is built outside the timer; the decorator
+            # still parses the JSON body and builds both keys each call
+            latencies = []
+            for i in range(iterations):
+                client = i % clients
+                with server.app.test_request_context("/verify", method="POST", json={"user_id": f"bench-{client}"},
+                                                     environ_base={"REMOTE_ADDR": address(client)}):
+                    t0 = time.perf_counter()
+                    verify()
+                    latencies.append(time.perf_counter() - t0)
+            # Throughput of the decorator alone, without building the contexts
+            results.append(summarize(f"ratelimit.{clients}_clients", latencies, sum(latencies),
+                                     clients=clients, tracked_keys=len(limiter)))
+
+            keys = [f"verify:ip:{address(i)}" for i in range(clients)]
+            latencies, elapsed = timed_loop(lambda i: limiter.hit(keys[i % clients], iterations + 1, 60), iterations)
+            results.append(summarize(f"ratelimit.limiter_{clients}_clients", latencies, elapsed, clients=clients))
+    finally:
+        server.limiter = saved_limiter
+    return results
+
+
+DESKTOP_APPS = [
+    ("totp_client.py", "TOTPGenerator"),
+    ("totp_multi_client.py", "MultiAccountAuthenticator"),
+    ("auth-app-gui.py", "TOTPAuthenticator"),
+    ("totp_qr_generator.py", "TOTPQRGenerator"),
+]
+
+# Stacks the desktop apps must only import on first use
+HEAVY_MODULES = ("cv2", "pyzbar", "qrcode", "PIL")
+
+# Run in a fresh interpreter per sample so nothing is already imported
+_STARTUP_PROBE = """
+import importlib.util, json, sys, time
+path, class_name, heavy = sys.argv[1], sys.argv[2], sys.argv[3].split(",")
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location("startup_probe", path)
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+result = {"import": time.perf_counter() - start, "window": None}
+import tkinter
+try:
+    root = tkinter.Tk()
+except tkinter.TclError:
+    # No display; only the import is measured
+    root = None
+if root is not None:
+    getattr(module, class_name)(root)
+    # Drop startup callbacks such as the vault password prompt, then draw
+    for job in root.tk.splitlist(root.tk.call("after", "info")):
+        root.after_cancel(job)
+    root.update()
+    result["window"] = time.perf_counter() - start
+    root.destroy()
+result["heavy"] = [name for name in heavy if name in sys.modules]
+print(json.dumps(result))
+"""
+
+
+def bench_startup(runs):
+    """Import time and time to first drawn window of each desktop app, one fresh interpreter per run"""
+    directory = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    for path, class_name in DESKTOP_APPS:
+        samples = []
+        start = time.perf_counter()
+        for _ in range(runs):
+            output = subprocess.run(
+                [sys.executable, "-c", _STARTUP_PROBE, path, class_name, ",".join(HEAVY_MODULES)],
+                cwd=directory, capture_output=True, text=True, check=True,
+            ).stdout
+            samples.append(json.loads(output.splitlines()[-1]))
+        elapsed = time.perf_counter() - start
+
+        windows = sorted(sample["window"] for sample in samples if sample["window"] is not None)
+        heavy = sorted({name for sample in samples for name in sample["heavy"]})
+        results.append(summarize(f"startup.{os.path.splitext(path)[0]}", [sample["import"] for sample in samples],
+                                 elapsed, window_p50_us=windows[len(windows) // 2] * 1e6 if windows else None,
+                                 heavy_imports=heavy))
+    return results
+
+
+def startup_regressions(results, max_startup_ms):
+    """Describe every startup result that imports a heavy stack eagerly or is too slow"""
+    problems = []
+    for result in results:
+        if not result["name"].startswith("startup."):
+            continue
+        if result["heavy_imports"]:
+            problems.append(f"{result['name']} imports {', '.join(result['heavy_imports'])} at startup")
+        startup_us = result["window_p50_us"] if result["window_p50_us"] is not None else result["p50_us"]
+        if max_startup_ms is not None and startup_us > max_startup_ms * 1000:
+            problems.append(f"{result['name']} takes {startup_us / 1000:.0f}ms, over {max_startup_ms:g}ms")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the TOTP verification path")
+    parser.add_argument("suite", choices=["codes", "http", "ratelimit", "startup", "all"])
+    parser.add_argument("--iterations", type=int, default=20000, help="operations per micro-benchmark")
+    parser.add_argument("--requests", type=int, default=2000, help="HTTP requests per route")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent HTTP clients")
+    parser.add_argument("--clients", type=int, nargs="+", default=[100, 1000, 10000, 100000],
+                        help="distinct client counts for the rate-limiter benchmark")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per desktop app for the startup benchmark")
+    parser.add_argument("--max-startup-ms", type=float,
+                        help="fail if a desktop app's median startup exceeds this many milliseconds")
+    parser.add_argument("--output", help="write results to this JSON file")
+    args = parser.parse_args(argv)
+
+    results = []
+    if args.suite in ("codes", "all"):
+        results += bench_codes(args.iterations)
+    if args.suite in ("http", "all"):
+        results += bench_http(args.requests, args.concurrency)
+    if args.suite in ("ratelimit", "all"):
+        results += bench_ratelimit(args.clients, args.iterations)
+    if args.suite in ("startup", "all"):
+        results += bench_startup(args.runs)
+
+    for result in results:
+        print(f"{result['name']:<32} {result['ops_per_sec']:>12.0f} ops/s  "
+              f"p50 {result['p50_us']:>9.1f}us  p95 {result['p95_us']:>9.1f}us  p99 {result['p99_us']:>9.1f}us")
+
+    if args.output:
+        report = {
+            "timestamp": time.time(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "pyotp": getattr(pyotp, "__version__", "unknown"),
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results saved to {args.output}")
+
+    problems = startup_regressions(results, args.max_startup_ms)
+    if problems:
+        parser.exit(1, "Startup regressions:\n" + "".join(f"  {problem}\n" for problem in problems))
+
+
+if __name__ == "__main__":
+    main()
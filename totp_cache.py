@@ -0,0 +1,83 @@
+import threading
+import time
+from collections import OrderedDict
+
+from pyotp.utils import strings_equal
+
+
+def first_match(code, offsets, code_at):
+    """Return the first offset whose code_at(offset) equals code, or None
+
+    Codes are computed lazily, so a match on the first offset costs a
+    single HMAC. Stopping at the first match only reveals, through timing,
+    which step an accepted code belonged to; a rejected code always costs
+    the full set of comparisons.
+    """
+    code = str(code)
+    for offset in offsets:
+        if strings_equal(code, code_at(offset)):
+            return offset
+    return None
+
+
+class VerificationCache:
+    """LRU cache of expected TOTP codes per user and time step
+
+    Each entry holds the codes computed so far for one user's current step,
+    keyed by step offset, so repeated verifications within the same step
+    skip base32 decoding and HMAC computation entirely. Codes are only
+    computed for the offsets actually tried, most likely first (see
+    totp_drift.candidate_offsets). Entries are reset when the step rolls
+    over or the user's credential changes. Steps, digits and algorithm come
+    from each user's totp_store.Credential.
+
+    hits and misses count individual codes, so misses is the number of
+    HMACs computed.
+    """
+
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _entry(self, user_id, credential, step):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] != credential or entry[1] != step:
+                entry = self._entries[user_id] = (credential, step, {}, credential.totp())
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            return entry
+
+    def _code(self, step, codes, totp, offset):
+        code = codes.get(offset)
+        if code is not None:
+            self.hits += 1
+            return code
+        self.misses += 1
+        # Computed outside the lock so a miss does not stall other users; a
+        # concurrent miss on the same entry at worst computes the code twice
+        code = codes[offset] = totp.generate_otp(step + offset)
+        return code
+
+    def match(self, user_id, credential, code, now=None, offsets=(0, -1, 1)):
+        """Return the step a code is valid for, trying offsets in order, or None"""
+        if now is None:
+            now = time.time()
+        step = int(now // credential.period)
+        _, _, codes, totp = self._entry(user_id, credential, step)
+        offset = first_match(code, offsets, lambda offset: self._code(step, codes, totp, offset))
+        return None if offset is None else step + offset
+
+    def invalidate(self, user_id):
+        """Drop the cached codes for a user, e.g. after re-registration"""
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def stats(self):
+        """Return hit/miss counters and current size"""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
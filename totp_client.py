@@ -1,16 +1,10 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
-import pyotp
-import cv2
-from pyzbar.pyzbar import decode
-from PIL import Image, ImageTk
-import base64
-import secrets
-import re
-from datetime import datetime
-import threading
 import time
 
+from totp_prewarm import prewarm
+from totp_uri import parse_otpauth_uri
+
 class TOTPGenerator:
     def __init__(self, root):
         self.root = root
@@ -19,6 +13,8 @@ class TOTPGenerator:
         
         self._current_secret = None
         self._current_totp = None
+        self._current_step = None
+        self._update_job = None
         
         self.setup_ui()
         
@@ -63,21 +59,11 @@ class TOTPGenerator:
         )
         if file_path:
             try:
-                # Read the image
-                image = cv2.imread(file_path)
-                if image is None:
-                    raise ValueError("Cannot read image file")
-                
-                # Convert to grayscale
-                gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-                
-                # Decode QR code
-                decoded_objects = decode(gray)
-                if not decoded_objects:
-                    raise ValueError("No QR code found in image")
-                
+                # OpenCV is only imported once a QR code is actually needed
+                from totp_qr_ingest import decode_file
+
                 # Process the first QR code found
-                self.process_qr_data(decoded_objects[0].data.decode('utf-8'))
+                self.process_qr_data(decode_file(file_path)[0])
                 
             except Exception as e:
                 messagebox.showerror("Error", f"Error processing image: {str(e)}")
@@ -85,54 +71,24 @@ class TOTPGenerator:
     def scan_qr(self):
         """Scan QR code using camera"""
         try:
-            cap = cv2.VideoCapture(0)
-            if not cap.isOpened():
-                messagebox.showerror("Error", "Cannot access camera")
-                return
-                
-            while True:
-                ret, frame = cap.read()
-                if not ret:
-                    break
-                    
-                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                decoded_objects = decode(gray)
-                
-                for obj in decoded_objects:
-                    cap.release()
-                    cv2.destroyAllWindows()
-                    self.process_qr_data(obj.data.decode('utf-8'))
-                    return
-                
-                cv2.imshow('Scan QR Code (Press q to quit)', frame)
-                if cv2.waitKey(1) & 0xFF == ord('q'):
-                    break
-                    
-            cap.release()
-            cv2.destroyAllWindows()
+            from totp_qr_ingest import scan_camera
+
+            data = scan_camera()
+            if data:
+                self.process_qr_data(data)
             
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
         except Exception as e:
             messagebox.showerror("Error", f"Error scanning QR code: {str(e)}")
             
     def process_qr_data(self, data):
         """Process the scanned QR data securely"""
         try:
-            if not data.startswith('otpauth://totp/'):
-                raise ValueError("Invalid OTP URI format")
+            parsed = parse_otpauth_uri(data)
                 
-            secret_match = re.search(r'secret=([A-Z2-7]+=*)', data)
-            if not secret_match:
-                raise ValueError("No valid secret found in QR code")
-                
-            secret = secret_match.group(1)
-            
-            try:
-                base64.b32decode(secret)
-            except Exception:
-                raise ValueError("Invalid secret encoding")
-                
-            self._current_secret = secret
-            self._current_totp = pyotp.TOTP(secret)
+            self._current_secret = parsed.secret
+            self._current_totp = parsed.totp()
             
             self.status_label.config(text="✓ Secret secured in memory", foreground="green")
             
@@ -143,23 +99,31 @@ class TOTPGenerator:
             self.status_label.config(text="✗ Error processing QR code", foreground="red")
             
     def start_totp_updates(self):
-        """Start updating TOTP codes"""
-        def update_totp():
-            while True:
-                try:
-                    if self._current_totp:
-                        totp = self._current_totp.now()
-                        remaining = 30 - datetime.now().timestamp() % 30
-                        
-                        self.totp_label.config(text=totp)
-                        self.time_label.config(text=f"Time remaining: {int(remaining)}s")
-                        self.progress['value'] = (remaining / 30) * 100
-                        
-                    time.sleep(0.1)
-                except Exception:
-                    break
-                    
-        threading.Thread(target=update_totp, daemon=True).start()
+        """Start updating TOTP codes on the Tk main loop"""
+        # Only one update loop at a time, however often a code is scanned
+        if self._update_job is not None:
+            self.root.after_cancel(self._update_job)
+        self._current_step = None
+        self.update_totp()
+
+    def update_totp(self):
+        """Refresh the countdown, recomputing the code only when the step changes"""
+        self._update_job = None
+        if not self._current_totp:
+            return
+        
+        now = time.time()
+        period = self._current_totp.interval
+        step = int(now // period)
+        if step != self._current_step:
+            self._current_step = step
+            self.totp_label.config(text=self._current_totp.at(now))
+        
+        remaining = period - now % period
+        self.time_label.config(text=f"Time remaining: {int(remaining)}s")
+        self.progress['value'] = (remaining / period) * 100
+        
+        self._update_job = self.root.after(100, self.update_totp)
 
     def __del__(self):
         """Secure cleanup"""
@@ -169,4 +133,5 @@ class TOTPGenerator:
 if __name__ == "__main__":
     root = tk.Tk()
     app = TOTPGenerator(root)
+    root.after_idle(prewarm, "totp_qr_ingest")
     root.mainloop()
\ No newline at end of file
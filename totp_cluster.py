@@ -0,0 +1,364 @@
+"""Cluster mode: users consistent-hashed across verification shards
+
+    python totp_cluster.py local --shards 4 --port 5000
+    python totp_cluster.py shard --port 5001
+    python totp_cluster.py router --port 5000 --node a=http://10.0.0.1:5001 --node b=http://10.0.0.2:5001
+
+A shard is an ordinary totp_verification_server process started with
+TOTP_CLUSTER_ROLE=shard. Every user_id is owned by exactly one shard,
+picked on a consistent-hash ring of node names with many virtual points
+per node, so that shard alone holds the user's cached credential, replay
+state, drift estimate and per-user rate limits. Adding a node to a ring of
+N moves only about 1/(N+1) of the users, and removing one only moves the
+users it owned.
+
+The router is a thin Flask app. It applies the per-IP rate limits (shards
+only ever see the router's address and skip them), hashes the user_id and
+forwards the request over per-thread keep-alive connections to the owner.
+Connections are only kept alive when shards are served by waitress (used
+when installed) or another production WSGI server; the Flask development
+server closes each one after a response.
+/verify/batch is split by owner, forwarded concurrently and merged back in
+request order. The ring can also be given as TOTP_CLUSTER_NODES, e.g. for
+`gunicorn 'totp_cluster:create_router()'`.
+
+Shards share the secret store (one TOTP_STORE_PATH, as `local` does), so
+moving a user only costs a cache miss. Replay state does not move: right
+after a resize a code accepted by the old owner within its window could be
+accepted once more by the new one. Bulk enrollment is not routed; run
+`totp_enroll.py import` against the shared store instead.
+"""
+import argparse
+import bisect
+import hashlib
+import http.client
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from flask import Flask, Response, request, jsonify
+
+from totp_metrics import Registry
+from totp_rate_limiter import create_limiter
+
+try:
+    from waitress import serve as _waitress_serve
+except ImportError:
+    # The Flask development server works too, but closes every connection
+    # after one response, so the router cannot keep connections alive
+    _waitress_serve = None
+
+# Per-IP limits of the shard routes, as in totp_verification_server
+ROUTE_LIMITS = {
+    'register': (3, 60),
+    'verify': (3, 60),
+    'verify_batch': (60, 60),
+}
+
+# Same cap as totp_verification_server.MAX_BATCH_SIZE
+MAX_BATCH_SIZE = 10000
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent-hash ring mapping keys to node names
+
+    Each node is placed at `points` pseudo-random positions; a key belongs
+    to the first node position at or after its own hash.
+    """
+
+    def __init__(self, nodes=(), points=128):
+        self.points = points
+        self.nodes = set()
+        self._hashes = []
+        self._owners = []
+        for node in nodes:
+            self.add(node)
+
+    def _rebuild(self):
+        ring = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(self.points))
+        self._hashes = [h for h, _ in ring]
+        self._owners = [node for _, node in ring]
+
+    def add(self, node):
+        self.nodes.add(node)
+        self._rebuild()
+
+    def remove(self, node):
+        self.nodes.discard(node)
+        self._rebuild()
+
+    def shares(self):
+        """Return {node: fraction of the hash space it owns}"""
+        shares = dict.fromkeys(self.nodes, 0)
+        if self._hashes:
+            previous = self._hashes[-1] - (1 << 64)
+            for h, node in zip(self._hashes, self._owners):
+                shares[node] += (h - previous) / (1 << 64)
+                previous = h
+        return shares
+
+    def owner(self, key):
+        """Return the node that owns key"""
+        if not self._hashes:
+            raise LookupError("Hash ring has no nodes")
+        index = bisect.bisect_left(self._hashes, _hash(key))
+        return self._owners[index % len(self._owners)]
+
+
+class NodePool:
+    """Keep-alive HTTP connections to each node, one per node and thread"""
+
+    def __init__(self, urls, timeout=10):
+        self.urls = {name: urlsplit(url) for name, url in urls.items()}
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self, name):
+        connections = getattr(self._local, "connections", None)
+        if connections is None:
+            connections = self._local.connections = {}
+        conn = connections.get(name)
+        if conn is None:
+            url = self.urls[name]
+            cls = http.client.HTTPSConnection if url.scheme == "https" else http.client.HTTPConnection
+            conn = connections[name] = cls(url.hostname, url.port, timeout=self.timeout)
+        return conn
+
+    def request(self, name, method, path, body=None, headers=None):
+        """Send a request to a node and return (status, content_type, body)"""
+        for attempt in range(2):
+            conn = self._connection(name)
+            reused = conn.sock is not None
+            try:
+                conn.request(method, path, body, headers or {})
+                response = conn.getresponse()
+                return response.status, response.getheader("Content-Type"), response.read()
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                # Only a keep-alive connection the node already closed is retried
+                if attempt or not reused:
+                    raise
+        raise AssertionError("unreachable")
+
+
+def parse_nodes(specs):
+    """Parse name=url node specs (a list, or one comma-separated string) into a dict"""
+    if isinstance(specs, str):
+        specs = [spec for spec in specs.split(",") if spec.strip()]
+    nodes = {}
+    for spec in specs:
+        name, sep, url = spec.strip().partition("=")
+        if not sep or not name or not url:
+            raise ValueError(f"Expected name=url, got {spec!r}")
+        nodes[name] = url
+    return nodes
+
+
+def create_router(nodes=None, points=128, workers=16):
+    """Build the router app for {name: url} nodes (defaults to TOTP_CLUSTER_NODES)"""
+    if nodes is None:
+        nodes = parse_nodes(os.environ.get("TOTP_CLUSTER_NODES", ""))
+    if not nodes:
+        raise ValueError("No cluster nodes configured")
+
+    app = Flask(__name__)
+    ring = HashRing(nodes, points)
+    pool = NodePool(nodes)
+    fanout = ThreadPoolExecutor(max_workers=workers)
+    limiter = create_limiter()
+
+    metrics = Registry()
+    FORWARD_LATENCY = metrics.histogram('totp_router_forward_seconds', 'Latency of requests forwarded to shards', ['node'])
+    FORWARDED = metrics.counter('totp_router_requests_total', 'Requests forwarded to shards by route, node and status', ['route', 'node', 'status'])
+
+    def forward(route, node, path, payload):
+        # Safe to call from fan-out threads: nothing here touches the Flask request
+        start = time.perf_counter()
+        try:
+            status, content_type, body = pool.request(node, "POST", path, json.dumps(payload),
+                                                      {"Content-Type": "application/json"})
+        except (http.client.HTTPException, OSError):
+            FORWARDED.inc(route, node, 'unavailable')
+            return 502, "application/json", json.dumps({"error": "Shard unavailable"}).encode("utf-8")
+        FORWARD_LATENCY.observe(time.perf_counter() - start, node)
+        FORWARDED.inc(route, node, str(status))
+        return status, content_type, body
+
+    def over_ip_limit(route):
+        max_requests, window = ROUTE_LIMITS[route]
+        return not limiter.hit(f"{route}:ip:{request.remote_addr}", max_requests, window)
+
+    def route_by_user(route):
+        if over_ip_limit(route):
+            return jsonify({"error": "Rate limit exceeded"}), 429
+        data = request.get_json(silent=True)
+        user_id = data.get('user_id') if isinstance(data, dict) else None
+        if not user_id:
+            return jsonify({"error": "Missing required fields"}), 400
+        status, content_type, body = forward(route, ring.owner(str(user_id)), request.path, data)
+        return Response(body, status=status, content_type=content_type)
+
+    @app.route('/register', methods=['POST'])
+    def register():
+        return route_by_user('register')
+
+    @app.route('/verify', methods=['POST'])
+    def verify():
+        return route_by_user('verify')
+
+    @app.route('/verify/batch', methods=['POST'])
+    def verify_batch():
+        if over_ip_limit('verify_batch'):
+            return jsonify({"error": "Rate limit exceeded"}), 429
+        try:
+            if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+                items = [json.loads(line) for line in request.get_data(as_text=True).splitlines() if line.strip()]
+            else:
+                items = request.get_json()
+                if isinstance(items, dict):
+                    items = items.get('items')
+                if not isinstance(items, list):
+                    raise ValueError("Expected a list of items")
+        except Exception as e:
+            return jsonify({"error": str(e)}), 400
+        if len(items) > MAX_BATCH_SIZE:
+            return jsonify({"error": f"Batch exceeds {MAX_BATCH_SIZE} items"}), 413
+
+        # Group item positions by owner; items without a user_id are answered here
+        results = [None] * len(items)
+        user_ids = [None] * len(items)
+        groups = {}
+        for index, item in enumerate(items):
+            if isinstance(item, dict):
+                user_id = item.get('user_id')
+            elif isinstance(item, (list, tuple)) and len(item) == 2:
+                user_id = item[0]
+            else:
+                user_id = None
+            if not user_id:
+                results[index] = {"user_id": user_id, "valid": False, "error": "Missing required fields"}
+                continue
+            user_ids[index] = user_id
+            groups.setdefault(ring.owner(str(user_id)), []).append(index)
+
+        def run(group):
+            node, indexes = group
+            status, _, body = forward('verify_batch', node, "/verify/batch", [items[i] for i in indexes])
+            return indexes, status, body
+
+        for indexes, status, body in fanout.map(run, list(groups.items())):
+            shard_results = json.loads(body).get('results') if status == 200 else None
+            if not shard_results or len(shard_results) != len(indexes):
+                error = "Shard unavailable" if status == 502 else f"Shard error ({status})"
+                shard_results = [{"user_id": user_ids[i], "valid": False, "error": error} for i in indexes]
+            for index, result in zip(indexes, shard_results):
+                results[index] = result
+
+        return jsonify({"results": results}), 200
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics_endpoint():
+        """Expose router metrics in Prometheus text format"""
+        return Response(metrics.render(), mimetype=metrics.content_type)
+
+    @app.route('/cluster', methods=['GET'])
+    def cluster():
+        """Describe the ring: nodes and the share of the hash space each owns"""
+        shares = ring.shares()
+        return jsonify({"nodes": {name: {"url": nodes[name], "share": round(shares[name], 4)}
+                                  for name in sorted(nodes)}}), 200
+
+    return app
+
+
+def serve(app, host, port, threads=16):
+    """Serve a WSGI app with waitress if installed, else the Flask development server"""
+    if _waitress_serve is None:
+        app.run(host=host, port=port, threaded=True)
+    else:
+        _waitress_serve(app, host=host, port=port, threads=threads)
+
+
+def run_shard(host, port):
+    """Serve totp_verification_server as a cluster shard"""
+    os.environ["TOTP_CLUSTER_ROLE"] = "shard"
+    import totp_verification_server as server
+    serve(server.app, host, port)
+
+
+def _wait_until_up(url, timeout=15):
+    parts = urlsplit(url)
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=1)
+            conn.request("GET", "/metrics")
+            conn.getresponse().read()
+            conn.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def run_local(shards, host, port):
+    """Start shard processes on the following ports and route to them from this one"""
+    nodes = {f"shard{i}": f"http://127.0.0.1:{port + i}" for i in range(1, shards + 1)}
+    processes = [
+        subprocess.Popen([sys.executable, os.path.abspath(__file__), "shard", "--port", str(port + i)])
+        for i in range(1, shards + 1)
+    ]
+    # Make a plain kill stop the shards too
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        for url in nodes.values():
+            _wait_until_up(url)
+        serve(create_router(nodes), host, port)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the TOTP verification service as a sharded cluster")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    shard = commands.add_parser("shard", help="serve one shard")
+    shard.add_argument("--host", default="127.0.0.1")
+    shard.add_argument("--port", type=int, required=True)
+
+    router = commands.add_parser("router", help="route requests to shards")
+    router.add_argument("--host", default="0.0.0.0")
+    router.add_argument("--port", type=int, default=5000)
+    router.add_argument("--node", action="append", default=[], help="name=url of a shard (repeatable)")
+    router.add_argument("--points", type=int, default=128, help="virtual points per node on the ring")
+
+    local = commands.add_parser("local", help="shards and router as local processes on one machine")
+    local.add_argument("--host", default="127.0.0.1")
+    local.add_argument("--port", type=int, default=5000, help="router port; shards use the next ports")
+    local.add_argument("--shards", type=int, default=4)
+
+    args = parser.parse_args(argv)
+    if args.command == "shard":
+        run_shard(args.host, args.port)
+    elif args.command == "router":
+        serve(create_router(parse_nodes(args.node) or None, args.points), args.host, args.port)
+    else:
+        run_local(args.shards, args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()
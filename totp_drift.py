@@ -0,0 +1,95 @@
+"""Per-user clock drift tracking for TOTP verification
+
+Every accepted code matched some time step offset from the server's
+current step. DriftTracker keeps a smoothed estimate of that offset per
+user: each accepted code moves the estimate halfway towards the offset it
+matched. A single code typed just before a step rolled over does not move
+the prediction, while a device that keeps running ahead is followed within
+two or three logins.
+
+Estimates are fixed-point integers in 1/16 of a step, and users whose
+estimate is zero are not stored at all, so memory is only spent on the few
+devices that actually drift. The table is bounded by max_users; the users
+whose estimate changed least recently are dropped first and simply fall
+back to the default window.
+
+Verification uses predict() to check the expected step first and only
+computes the codes around it, and around the server's own step, when that
+misses (see candidate_offsets).
+"""
+import os
+import threading
+
+# Fixed-point scale of stored estimates (1/16 of a time step)
+SCALE = 16
+
+
+def _whole_steps(estimate):
+    # Round to the nearest step, with exactly half a step rounding towards zero
+    steps = (abs(estimate) + SCALE // 2 - 1) // SCALE
+    return steps if estimate >= 0 else -steps
+
+
+def candidate_offsets(predicted, window=1):
+    """Step offsets to try, most likely first
+
+    The predicted offset comes first, then the rest of predicted±window,
+    then any of the default ±window not already covered, so a device whose
+    clock was corrected is still accepted.
+    """
+    offsets = [predicted]
+    for delta in range(1, window + 1):
+        offsets += [predicted - delta, predicted + delta]
+    offsets += [offset for offset in range(-window, window + 1) if offset not in offsets]
+    return offsets
+
+
+class DriftTracker:
+    """Smoothed time step offset of each user's device"""
+
+    def __init__(self, max_users=100000, max_drift=10):
+        self.max_users = max_users
+        self.max_drift = max_drift
+        self._estimates = {}
+        self._lock = threading.Lock()
+
+    def predict(self, user_id):
+        """Return the offset, in whole steps, the user's next code is expected at"""
+        return _whole_steps(self._estimates.get(user_id, 0))
+
+    def record(self, user_id, offset):
+        """Fold the offset of an accepted code into the user's estimate"""
+        offset = max(-self.max_drift, min(self.max_drift, offset))
+        with self._lock:
+            estimate = self._estimates.pop(user_id, 0)
+            # Halfway towards the new offset, truncating towards zero so estimates settle at 0
+            estimate = int((estimate + offset * SCALE) / 2)
+            if estimate:
+                self._estimates[user_id] = estimate
+                while len(self._estimates) > self.max_users:
+                    del self._estimates[next(iter(self._estimates))]
+
+    def estimate(self, user_id):
+        """Return the user's drift estimate in (fractional) steps"""
+        return self._estimates.get(user_id, 0) / SCALE
+
+    def forget(self, user_id):
+        """Drop a user's estimate, e.g. after re-registration"""
+        with self._lock:
+            self._estimates.pop(user_id, None)
+
+    def __len__(self):
+        return len(self._estimates)
+
+
+def create_drift_tracker(max_users=None, max_drift=None):
+    """Build the drift tracker
+
+    Settings fall back to the TOTP_DRIFT_MAX_USERS and TOTP_DRIFT_MAX_STEPS
+    environment variables.
+    """
+    if max_users is None:
+        max_users = int(os.environ.get("TOTP_DRIFT_MAX_USERS", "100000"))
+    if max_drift is None:
+        max_drift = int(os.environ.get("TOTP_DRIFT_MAX_STEPS", "10"))
+    return DriftTracker(max_users=max_users, max_drift=max_drift)
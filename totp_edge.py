@@ -0,0 +1,346 @@
+"""Signed offline verification bundles for edge sites
+
+    python totp_edge.py keygen --private edge.key --public edge.pub
+    python totp_edge.py export --users kiosk_users.txt --steps 2880 --key edge.key --output bundle.bin
+    python totp_edge.py serve --bundle bundle.bin --public-key edge.pub --port 5001
+
+export precomputes, for an allow-listed set of users, the codes of the next
+N time steps of each user (plus one step either side for the ±1 window) and
+stores only a salted 8-byte hash of (user_id, step, code) for each. No
+secret ever leaves the server. The file is:
+
+    header   magic, version, start time, steps, user and tag counts, salt
+    users    (user hash, period) per user, sorted by hash
+    tags     code hashes, sorted
+    trailer  Ed25519 signature over everything before it
+
+EdgeVerifier checks the signature once, maps the file with mmap and answers
+verify() with a handful of binary searches, in microseconds, with the same
+semantics as totp_verification_server: ±1 step, and each step accepted only
+once per user. `serve` wraps it in a small HTTP sidecar speaking the
+/verify contract, with the same per-user rate limit.
+
+A bundle is as sensitive as the codes it covers: with the file, 6-digit
+codes can be brute-forced offline for the bundle's users and time span. It
+exposes nothing after it expires, so keep N as short as the link outages
+it has to bridge and the allow-list to the site's users.
+"""
+import argparse
+import bisect
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+
+from totp_rate_limiter import SlidingWindowLimiter
+from totp_replay import ReplayGuard
+
+MAGIC = b"TOTPEDG1"
+_HEADER = struct.Struct("<8sBxxxdIII16s")
+_USER = struct.Struct("<QI")
+_TAG = struct.Struct("<Q")
+SIGNATURE_SIZE = 64
+
+
+class BundleError(Exception):
+    """Raised for a bundle that is damaged, unsigned or signed by another key"""
+
+
+def _user_hash(salt, user_id):
+    return int.from_bytes(hashlib.blake2b(str(user_id).encode("utf-8"), digest_size=8, key=salt).digest(), "little")
+
+
+def _code_tag(salt, user_id, step, code):
+    data = str(user_id).encode("utf-8") + b"\0" + step.to_bytes(8, "big") + str(code).encode("ascii")
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8, key=salt).digest(), "little")
+
+
+def _expected_codes(credentials, first_steps, count):
+    """Yield (index, step, code) for count steps of each credential from its first step"""
+    import numpy as np
+    from totp_bulk import compute_codes, decode_secrets, format_codes
+
+    # Users sharing parameters and first step are computed together
+    groups = {}
+    for index, credential in enumerate(credentials):
+        groups.setdefault((credential.algorithm, credential.digits, first_steps[index]), []).append(index)
+
+    for (algorithm, digits, first), indexes in groups.items():
+        steps = np.arange(first, first + count, dtype=np.int64)
+        if digits <= 9:
+            codes = format_codes(compute_codes(decode_secrets([credentials[i].secret for i in indexes]),
+                                               steps, digits, algorithm.lower()), digits)
+        else:
+            # compute_codes is limited to int32; ten digits go through pyotp
+            codes = [[credentials[i].totp().generate_otp(int(step)) for step in steps] for i in indexes]
+        for row, index in enumerate(indexes):
+            for column, step in enumerate(steps):
+                yield index, int(step), codes[row][column]
+
+
+def build_bundle(store, user_ids, steps, private_key, start=None):
+    """Return (bundle, missing): the signed bundle for user_ids over the next
+    `steps` steps, and the user_ids skipped because they are not enrolled
+    """
+    if start is None:
+        start = time.time()
+    salt = os.urandom(16)
+
+    users, credentials, missing = [], [], []
+    for user_id in dict.fromkeys(user_ids):
+        credential = store.get(user_id)
+        if credential is None:
+            missing.append(user_id)
+        else:
+            users.append(user_id)
+            credentials.append(credential)
+
+    # One extra step either side so the first and last step keep their ±1 window
+    first_steps = [int(start // c.period) - 1 for c in credentials]
+    tags = sorted(_code_tag(salt, users[index], step, code)
+                  for index, step, code in _expected_codes(credentials, first_steps, steps + 2))
+    table = sorted((_user_hash(salt, user_id), c.period) for user_id, c in zip(users, credentials))
+
+    parts = [_HEADER.pack(MAGIC, 1, start, steps, len(table), len(tags), salt)]
+    parts += [_USER.pack(*row) for row in table]
+    parts += [_TAG.pack(tag) for tag in tags]
+    body = b"".join(parts)
+    return body + private_key.sign(body), missing
+
+
+class _Column:
+    """Sequence view of the first field of fixed-size records, for bisect"""
+
+    def __init__(self, buffer, offset, count, record):
+        self.buffer = buffer
+        self.offset = offset
+        self.count = count
+        self.record = record
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        return self.record.unpack_from(self.buffer, self.offset + index * self.record.size)[0]
+
+    def find(self, value):
+        """Return the index of value, or None"""
+        index = bisect.bisect_left(self, value)
+        return index if index < self.count and self[index] == value else None
+
+
+class _NativeColumn:
+    """_Column over a memoryview already cast to unsigned 64-bit integers"""
+
+    def __init__(self, view):
+        self.view = view
+
+    def find(self, value):
+        index = bisect.bisect_left(self.view, value)
+        return index if index < len(self.view) and self.view[index] == value else None
+
+
+class EdgeVerifier:
+    """Verify codes locally against a signed bundle"""
+
+    def __init__(self, path, public_key, replay_guard=None):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._check(public_key)
+        except Exception:
+            self._map.close()
+            raise
+        self.replay_guard = replay_guard or ReplayGuard(capacity=max(1 << 10, self.user_count * 4))
+
+    def _check(self, public_key):
+        size = len(self._map)
+        if size < _HEADER.size + SIGNATURE_SIZE:
+            raise BundleError("Not a TOTP edge bundle")
+        magic, version, self.start, self.steps, self.user_count, tag_count, self._salt = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != 1:
+            raise BundleError("Not a TOTP edge bundle")
+        body_size = _HEADER.size + self.user_count * _USER.size + tag_count * _TAG.size
+        if body_size + SIGNATURE_SIZE != size:
+            raise BundleError("Truncated or padded bundle")
+        try:
+            public_key.verify(self._map[body_size:], self._map[:body_size])
+        except InvalidSignature:
+            raise BundleError("Bad bundle signature")
+
+        self._users = _Column(self._map, _HEADER.size, self.user_count, _USER)
+        tags_offset = _HEADER.size + self.user_count * _USER.size
+        if sys.byteorder == "little":
+            # Native view of the tag table, so bisect runs without unpacking in Python
+            self._tag_view = memoryview(self._map)[tags_offset:tags_offset + tag_count * _TAG.size].cast("Q")
+            self._tags = _NativeColumn(self._tag_view)
+        else:
+            self._tag_view = None
+            self._tags = _Column(self._map, tags_offset, tag_count, _TAG)
+
+    def period(self, user_id):
+        """Return the user's period, or None if the user is not in the bundle"""
+        index = self._users.find(_user_hash(self._salt, user_id))
+        if index is None:
+            return None
+        return _USER.unpack_from(self._map, _HEADER.size + index * _USER.size)[1]
+
+    def match(self, user_id, code, now=None):
+        """Return the step a code is valid for within ±1 step, or None
+
+        Raises LookupError when the user is not in the bundle or now is
+        outside the steps it covers; callers should fall back to the
+        central server.
+        """
+        if now is None:
+            now = time.time()
+        period = self.period(user_id)
+        if period is None:
+            raise LookupError("User not in bundle")
+        step = int(now // period)
+        first = int(self.start // period)
+        if not first <= step < first + self.steps:
+            raise LookupError("Bundle does not cover the current time")
+
+        for offset in (0, -1, 1):
+            if self._tags.find(_code_tag(self._salt, user_id, step + offset, code)) is not None:
+                return step + offset
+        return None
+
+    def verify(self, user_id, code, now=None):
+        """Return True if code is valid within ±1 step and its step was not used before
+
+        Raises LookupError like match().
+        """
+        step = self.match(user_id, code, now)
+        return step is not None and self.replay_guard.check_and_record(user_id, step)
+
+    def close(self):
+        if self._tag_view is not None:
+            self._tag_view.release()
+        self._map.close()
+
+
+def load_public_key(path):
+    with open(path, "rb") as f:
+        return serialization.load_pem_public_key(f.read())
+
+
+def load_private_key(path):
+    with open(path, "rb") as f:
+        return serialization.load_pem_private_key(f.read(), password=None)
+
+
+def serve(verifier, host="127.0.0.1", port=5001, user_max_requests=5, window=60):
+    """Serve POST /verify from a bundle with the central server's response contract"""
+    limiter = SlidingWindowLimiter()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _reply(self, status, body):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            if self.path != "/verify":
+                return self._reply(404, {"error": "Not found"})
+            try:
+                data = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                user_id, code = data.get("user_id"), data.get("code")
+            except Exception as e:
+                return self._reply(400, {"error": str(e)})
+            if not user_id or not code:
+                return self._reply(400, {"error": "Missing required fields"})
+            if not limiter.hit(f"verify:user:{user_id}", user_max_requests, window):
+                return self._reply(429, {"error": "Rate limit exceeded"})
+            try:
+                step = verifier.match(user_id, code)
+            except LookupError as e:
+                return self._reply(404, {"error": str(e)})
+            if step is None:
+                return self._reply(401, {"error": "Invalid code"})
+            if not verifier.replay_guard.check_and_record(user_id, step):
+                return self._reply(401, {"error": "Code already used"})
+            return self._reply(200, {"message": "Code verified successfully"})
+
+        def log_message(self, format, *args):
+            pass
+
+    ThreadingHTTPServer((host, port), Handler).serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline TOTP verification bundles for edge sites")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    keygen = commands.add_parser("keygen", help="create an Ed25519 signing key pair")
+    keygen.add_argument("--private", required=True, help="private key output (keep on the server)")
+    keygen.add_argument("--public", required=True, help="public key output (ship to edge sites)")
+
+    export = commands.add_parser("export", help="write a signed bundle for allow-listed users")
+    export.add_argument("--users", required=True, help="file with one user_id per line, or - for stdin")
+    export.add_argument("--steps", type=int, default=2880, help="time steps to cover (default: one day of 30s steps)")
+    export.add_argument("--key", required=True, help="PEM private signing key")
+    export.add_argument("--store", help="secret store path (defaults to TOTP_STORE_PATH)")
+    export.add_argument("--output", required=True)
+
+    sidecar = commands.add_parser("serve", help="answer POST /verify from a bundle")
+    sidecar.add_argument("--bundle", required=True)
+    sidecar.add_argument("--public-key", required=True)
+    sidecar.add_argument("--host", default="127.0.0.1")
+    sidecar.add_argument("--port", type=int, default=5001)
+
+    args = parser.parse_args(argv)
+    if args.command == "keygen":
+        key = Ed25519PrivateKey.generate()
+        with open(args.private, "xb") as f:
+            f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                      serialization.NoEncryption()))
+        with open(args.public, "wb") as f:
+            f.write(key.public_key().public_bytes(serialization.Encoding.PEM,
+                                                  serialization.PublicFormat.SubjectPublicKeyInfo))
+    elif args.command == "export":
+        from totp_store import create_store
+
+        if args.steps <= 0:
+            parser.error("--steps must be positive")
+        source = sys.stdin if args.users == "-" else open(args.users, encoding="utf-8")
+        try:
+            user_ids = [line.strip() for line in source if line.strip()]
+        finally:
+            if source is not sys.stdin:
+                source.close()
+
+        store = create_store(args.store)
+        try:
+            bundle, missing = build_bundle(store, user_ids, args.steps, load_private_key(args.key))
+        finally:
+            store.close()
+        # Write then rename, so a sidecar never maps a half-written bundle
+        tmp_path = f"{args.output}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(bundle)
+        os.replace(tmp_path, args.output)
+        for user_id in missing:
+            print(f"{user_id}: not enrolled", file=sys.stderr)
+        print(json.dumps({"users": len(user_ids) - len(missing), "missing": len(missing), "bytes": len(bundle)}))
+    else:
+        verifier = EdgeVerifier(args.bundle, load_public_key(args.public_key))
+        serve(verifier, args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""Bulk enrollment import and export for the secret store
+
+    python totp_enroll.py import users.csv --format csv
+    python totp_enroll.py import migrated.txt --format uri --errors errors.ndjson
+    python totp_enroll.py export --format ndjson --output backup.ndjson
+
+Input formats:
+    csv     rows of user_id,secret[,algorithm,digits,period] (an optional header row is skipped)
+    ndjson  one {"user_id": ..., "secret": ...} or {"user_id": ..., "uri": ...} per line,
+            optionally with algorithm, digits and period
+    uri     one otpauth:// URI per line; the account name becomes the user_id
+
+Algorithm, digits and period default to SHA1, 6 and 30 when not given.
+
+Rows are validated across a process pool and written in large transactions.
+Invalid rows are reported individually and never stop the run.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from totp_replay import create_replay_guard
+from totp_store import Credential, create_store, make_credential
+from totp_uri import OTPAuthURI, parse_otpauth_uri
+
+FORMATS = ("csv", "ndjson", "uri")
+
+
+def read_records(lines, fmt):
+    """Yield (line_no, record) pairs from text lines in the given format
+
+    A record is a dict with user_id and either secret or uri; a row that
+    cannot be parsed yields a record holding only an error.
+    """
+    if fmt == "csv":
+        for line_no, row in enumerate(csv.reader(lines), 1):
+            if not row or (line_no == 1 and row[0].strip().lower() == "user_id"):
+                continue
+            if len(row) < 2:
+                yield line_no, {"error": "Expected user_id,secret"}
+                continue
+            record = {"user_id": row[0].strip(), "secret": row[1].strip()}
+            for field, value in zip(("algorithm", "digits", "period"), row[2:]):
+                if value.strip():
+                    record[field] = value.strip()
+            yield line_no, record
+    elif fmt == "ndjson":
+        for line_no, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield line_no, {"error": f"Invalid JSON: {e}"}
+                continue
+            yield line_no, record if isinstance(record, dict) else {"error": "Expected a JSON object"}
+    elif fmt == "uri":
+        for line_no, line in enumerate(lines, 1):
+            if line.strip():
+                yield line_no, {"uri": line.strip()}
+    else:
+        raise ValueError(f"Unknown format: {fmt}")
+
+
+def validate_record(line_no, record):
+    """Return (line_no, user_id, credential, error) for one record"""
+    if "error" in record:
+        return line_no, record.get("user_id"), None, record["error"]
+    user_id = record.get("user_id")
+    try:
+        if record.get("uri"):
+            parsed = parse_otpauth_uri(record["uri"])
+            user_id = user_id or parsed.account
+            fields = (parsed.secret, parsed.algorithm, parsed.digits, parsed.period)
+        else:
+            fields = (record.get("secret"), record.get("algorithm"), record.get("digits"), record.get("period"))
+        if isinstance(user_id, int) and not isinstance(user_id, bool):
+            user_id = str(user_id)
+        if not user_id:
+            raise ValueError("Missing user_id")
+        if not isinstance(user_id, str):
+            raise ValueError("user_id must be a string")
+        # Same check register() applies to a single enrollment
+        credential = make_credential(*fields)
+    except Exception as e:
+        return line_no, user_id, None, str(e)
+    return line_no, user_id, credential, None
+
+
+def _validate_batch(batch):
+    return [validate_record(line_no, record) for line_no, record in batch]
+
+
+def _batches(records, size):
+    records = iter(records)
+    while True:
+        batch = list(islice(records, size))
+        if not batch:
+            return
+        yield batch
+
+
+def import_records(records, store, workers=None, batch_size=10000, on_error=None, on_import=None, executor=None):
+    """Validate records in parallel and write the valid ones to the store
+
+    Each batch of valid rows is written in one transaction. on_error is
+    called with a dict per rejected row, and on_import with the user_ids of
+    each written batch. A long-running caller can pass its
+    own process pool as executor, with workers set to its size, instead of
+    one being started per call. Returns counts of imported and failed rows.
+    """
+    imported = failed = 0
+
+    def handle(results):
+        nonlocal imported, failed
+        valid = []
+        for line_no, user_id, credential, error in results:
+            if error is None:
+                valid.append((user_id, credential))
+                continue
+            failed += 1
+            if on_error is not None:
+                on_error({"line": line_no, "user_id": user_id, "error": error})
+        if valid:
+            store.put_many(valid)
+            imported += len(valid)
+            if on_import is not None:
+                on_import([user_id for user_id, _ in valid])
+
+    def run(pool):
+        # Only a few batches are in flight, so input is streamed rather than loaded
+        pending = []
+        for batch in _batches(records, batch_size):
+            pending.append(pool.submit(_validate_batch, batch))
+            if len(pending) >= 2 * workers:
+                handle(pending.pop(0).result())
+        for future in pending:
+            handle(future.result())
+
+    workers = workers or os.cpu_count()
+    if executor is not None:
+        run(executor)
+    elif workers == 1:
+        for batch in _batches(records, batch_size):
+            handle(_validate_batch(batch))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            run(pool)
+
+    return {"imported": imported, "failed": failed}
+
+
+def export_records(store, out, fmt, issuer=None):
+    """Stream every enrolled credential from the store to out in the given format"""
+    writer = csv.writer(out) if fmt == "csv" else None
+    if writer:
+        writer.writerow(["user_id", *Credential._fields])
+    count = 0
+    for user_id, credential in store.iter_credentials():
+        if writer:
+            writer.writerow([user_id, *credential])
+        elif fmt == "ndjson":
+            out.write(json.dumps({"user_id": user_id, **credential._asdict()}) + "\n")
+        else:
+            out.write(OTPAuthURI(credential.secret, user_id, issuer, *credential[1:]).to_uri() + "\n")
+        count += 1
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import or export TOTP enrollments")
+    parser.add_argument("--store", help="secret store path (defaults to TOTP_STORE_PATH)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    importer = commands.add_parser("import", help="import enrollments from a file or stdin")
+    importer.add_argument("input", help="input file, or - for stdin")
+    importer.add_argument("--format", choices=FORMATS, default="csv")
+    importer.add_argument("--workers", type=int, help="validation processes (default: CPU count)")
+    importer.add_argument("--batch-size", type=int, default=10000, help="rows per transaction")
+    importer.add_argument("--errors", help="write per-row errors as NDJSON to this file (default: stderr)")
+
+    exporter = commands.add_parser("export", help="export enrollments to a file or stdout")
+    exporter.add_argument("--format", choices=FORMATS, default="ndjson")
+    exporter.add_argument("--issuer", help="issuer for exported otpauth:// URIs")
+    exporter.add_argument("--output", help="output file (default: stdout)")
+
+    args = parser.parse_args(argv)
+    # Bulk writes go straight to the backend; there is nothing to cache
+    store = create_store(args.store, cache_size=0)
+
+    if args.command == "import":
+        source = sys.stdin if args.input == "-" else open(args.input, newline="", encoding="utf-8")
+        errors = open(args.errors, "w", encoding="utf-8") if args.errors else sys.stderr
+        # A replay table shared with the servers must not keep the old credentials' steps
+        replay_guard = create_replay_guard() if os.environ.get("TOTP_REPLAY_PATH") else None
+
+        def on_import(user_ids):
+            if replay_guard is not None:
+                for user_id in user_ids:
+                    replay_guard.forget(user_id)
+
+        try:
+            summary = import_records(
+                read_records(source, args.format),
+                store,
+                workers=args.workers,
+                batch_size=args.batch_size,
+                on_error=lambda error: errors.write(json.dumps(error) + "\n"),
+                on_import=on_import,
+            )
+        finally:
+            if source is not sys.stdin:
+                source.close()
+            if errors is not sys.stderr:
+                errors.close()
+        print(json.dumps(summary))
+    else:
+        out = open(args.output, "w", newline="", encoding="utf-8") if args.output else sys.stdout
+        count = export_records(store, out, args.format, args.issuer)
+        if args.output:
+            out.close()
+        print(f"Exported {count} enrollments", file=sys.stderr)
+
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""Low-overhead Prometheus-style metrics
+
+Counters and histograms aggregate into per-thread shards, so recording a
+sample never takes a lock once a thread has its shard. When a thread
+exits, its shard is folded into a retired total, so thread-per-request
+servers keep one shard per live thread rather than one per request. Shards
+are merged only when the registry is rendered for a scrape.
+"""
+import bisect
+import threading
+import weakref
+
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = {}
+        self._retired = {}
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        """Return this thread's shard, registering it on first use"""
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            # The thread-local owner is freed when the thread exits
+            owner = self._local.owner = _ShardOwner()
+            with self._lock:
+                self._shards[id(owner)] = shard
+            weakref.finalize(owner, self._retire, id(owner))
+        return shard
+
+    def _retire(self, key):
+        with self._lock:
+            self._fold(self._retired, self._shards.pop(key))
+
+    def _snapshot(self):
+        with self._lock:
+            shards = [self._retired] + list(self._shards.values())
+            # Copy each shard so a concurrent insert cannot break iteration
+            return [dict(shard) for shard in shards]
+
+    def _totals(self):
+        totals = {}
+        for shard in self._snapshot():
+            self._fold(totals, shard)
+        return totals
+
+    def _fold(self, totals, shard):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        return lines + self._render_samples()
+
+    def _render_samples(self):
+        raise NotImplementedError
+
+
+class _ShardOwner:
+    """Per-thread object whose collection retires the thread's shard"""
+
+    __slots__ = ("__weakref__",)
+
+
+class Counter(_Metric):
+    """Monotonic counter with optional labels"""
+
+    kind = "counter"
+
+    def inc(self, *labelvalues, amount=1):
+        shard = self._shard()
+        shard[labelvalues] = shard.get(labelvalues, 0) + amount
+
+    def value(self, *labelvalues):
+        return sum(shard.get(labelvalues, 0) for shard in self._snapshot())
+
+    def _fold(self, totals, shard):
+        for labelvalues, value in shard.items():
+            totals[labelvalues] = totals.get(labelvalues, 0) + value
+
+    def _render_samples(self):
+        totals = self._totals()
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {value}" for labels, value in sorted(totals.items())]
+
+
+class Histogram(_Metric):
+    """Histogram with fixed buckets and optional labels"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labelvalues):
+        shard = self._shard()
+        state = shard.get(labelvalues)
+        if state is None:
+            # Per-bucket counts (plus +Inf), then sum and count
+            state = shard[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    def _fold(self, totals, shard):
+        for labelvalues, (counts, total, count) in shard.items():
+            merged = totals.get(labelvalues)
+            if merged is None:
+                merged = totals[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            merged[0] = [a + b for a, b in zip(merged[0], counts)]
+            merged[1] += total
+            merged[2] += count
+
+    def _render_samples(self):
+        lines = []
+        for labelvalues, (counts, total, count) in sorted(self._totals().items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labelvalues, [('le', le)])} {cumulative}")
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class GaugeFunc(_Metric):
+    """Gauge whose value is read from a callback at scrape time"""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, func):
+        super().__init__(name, documentation)
+        self.func = func
+
+    def _render_samples(self):
+        return [f"{self.name} {self.func()}"]
+
+
+class Registry:
+    """Collection of metrics rendered together in the text exposition format"""
+
+    content_type = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, func):
+        return self.register(GaugeFunc(name, documentation, func))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
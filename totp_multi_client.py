@@ -0,0 +1,305 @@
+import tkinter as tk
+from tkinter import ttk, messagebox, filedialog, simpledialog
+import os
+import time
+
+import pyotp
+
+from totp_prewarm import prewarm
+from totp_uri import DIGESTS, parse_otpauth_uri
+from totp_vault import Vault, VaultError
+
+DEFAULT_VAULT_PATH = os.path.join(os.path.expanduser("~"), ".totp_vault")
+
+
+class Account:
+    """One TOTP credential shown in the account list
+
+    The secret is fetched through load_secret on first use, so accounts
+    loaded from the vault are only decrypted once their row is shown.
+    """
+
+    def __init__(self, account, issuer, algorithm, digits, period, load_secret, entry_id=None):
+        self.account = account
+        self.issuer = issuer or ""
+        self.algorithm = algorithm
+        self.digits = digits
+        self.period = period
+        self.entry_id = entry_id
+        self.step = None
+        self._load_secret = load_secret
+        self._totp = None
+
+    @classmethod
+    def from_uri(cls, uri, entry_id=None):
+        return cls(uri.account, uri.issuer, uri.algorithm, uri.digits, uri.period, lambda: uri.secret, entry_id)
+
+    @property
+    def totp(self):
+        if self._totp is None:
+            self._totp = pyotp.TOTP(self._load_secret(), digits=self.digits,
+                                    digest=DIGESTS[self.algorithm], interval=self.period)
+        return self._totp
+
+    @property
+    def placeholder(self):
+        return "-" * self.digits
+
+
+class TickScheduler:
+    """Drive all account codes from the Tk main loop with as few wake-ups as possible
+
+    Codes are recomputed in one batch per period, only when that period's
+    time step rolls over, via a single pending after() callback aimed at the
+    next boundary. The countdown is redrawn once per second, aligned to the
+    second boundary, only for rows currently visible, and not at all while
+    the window is minimised.
+    """
+
+    def __init__(self, root, on_step, on_redraw):
+        self.root = root
+        self.on_step = on_step
+        self.on_redraw = on_redraw
+        self.periods = set()
+        self._steps = {}
+        self._step_job = None
+        self._redraw_job = None
+        self._visible = True
+
+        root.bind("<Map>", self._on_map, add="+")
+        root.bind("<Unmap>", self._on_unmap, add="+")
+
+    def set_periods(self, periods):
+        """Track a new set of periods and recompute everything now"""
+        self.periods = set(periods)
+        self._steps = {}
+        self._schedule_step(0)
+        self._schedule_redraw()
+
+    def _schedule_step(self, delay_ms):
+        if self._step_job is not None:
+            self.root.after_cancel(self._step_job)
+        self._step_job = self.root.after(delay_ms, self._tick_step)
+
+    def _tick_step(self):
+        self._step_job = None
+        if not self.periods:
+            return
+
+        now = time.time()
+        rolled = []
+        for period in self.periods:
+            step = int(now // period)
+            if self._steps.get(period) != step:
+                self._steps[period] = step
+                rolled.append(period)
+        if rolled:
+            self.on_step(rolled, now)
+
+        # Sleep until the earliest next boundary, plus a little slack for timer jitter
+        wait = min(period - now % period for period in self.periods)
+        self._schedule_step(int(wait * 1000) + 5)
+
+    def _schedule_redraw(self):
+        if self._redraw_job is None and self._visible and self.periods:
+            delay = 1000 - int(time.time() * 1000) % 1000
+            self._redraw_job = self.root.after(delay + 5, self._tick_redraw)
+
+    def _tick_redraw(self):
+        self._redraw_job = None
+        self.on_redraw(time.time())
+        self._schedule_redraw()
+
+    def _on_map(self, event):
+        if event.widget is self.root:
+            self._visible = True
+            self._schedule_redraw()
+
+    def _on_unmap(self, event):
+        if event.widget is self.root:
+            self._visible = False
+            if self._redraw_job is not None:
+                self.root.after_cancel(self._redraw_job)
+                self._redraw_job = None
+
+
+class MultiAccountAuthenticator:
+    def __init__(self, root):
+        self.root = root
+        self.root.title("TOTP Authenticator")
+        self.root.geometry("520x480")
+
+        self.accounts = {}
+        self.vault = None
+        self.scheduler = TickScheduler(root, self.refresh_codes, self.redraw_visible)
+
+        self.setup_ui()
+        self.root.after_idle(self.unlock_vault)
+
+    def setup_ui(self):
+        main_frame = ttk.Frame(self.root, padding="10")
+        main_frame.pack(fill=tk.BOTH, expand=True)
+
+        # Input method buttons
+        input_frame = ttk.LabelFrame(main_frame, text="Add Account", padding="10")
+        input_frame.pack(fill=tk.X, pady=5)
+
+        ttk.Button(input_frame, text="Scan QR Code", command=self.scan_qr).grid(row=0, column=0, padx=5, pady=5)
+        ttk.Button(input_frame, text="Select QR Image", command=self.select_file).grid(row=0, column=1, padx=5, pady=5)
+        ttk.Button(input_frame, text="Paste URI", command=self.paste_uri).grid(row=0, column=2, padx=5, pady=5)
+        ttk.Button(input_frame, text="Remove", command=self.remove_selected).grid(row=0, column=3, padx=5, pady=5)
+
+        # Account list; only rows scrolled into view are redrawn
+        list_frame = ttk.LabelFrame(main_frame, text="Accounts", padding="10")
+        list_frame.pack(fill=tk.BOTH, expand=True, pady=5)
+
+        columns = ("issuer", "account", "code", "remaining")
+        self.tree = ttk.Treeview(list_frame, columns=columns, show="headings", selectmode="browse")
+        for column, heading, width in (("issuer", "Issuer", 110), ("account", "Account", 170),
+                                       ("code", "Code", 100), ("remaining", "Expires", 60)):
+            self.tree.heading(column, text=heading)
+            self.tree.column(column, width=width, anchor=tk.W if column in ("issuer", "account") else tk.CENTER)
+        scrollbar = ttk.Scrollbar(list_frame, orient=tk.VERTICAL, command=self.tree.yview)
+        def on_scroll(*args):
+            scrollbar.set(*args)
+            # Rows scrolled into view get their code straight away
+            self.redraw_visible(time.time())
+        self.tree.configure(yscrollcommand=on_scroll)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        self.status_label = ttk.Label(main_frame, text="✓ Waiting for QR code", foreground="gray")
+        self.status_label.pack(pady=5)
+
+    def unlock_vault(self):
+        """Open (or create) the encrypted vault and list its accounts"""
+        path = os.environ.get("TOTP_VAULT_PATH", DEFAULT_VAULT_PATH)
+        exists = os.path.exists(path)
+        prompt = "Vault password:" if exists else "Choose a password for a new vault:"
+        password = simpledialog.askstring("Unlock Vault", prompt, show="*", parent=self.root)
+        if not password:
+            self.status_label.config(text="✓ Vault locked; accounts kept in memory only", foreground="gray")
+            return
+
+        try:
+            self.vault = Vault.open(path, password) if exists else Vault.create(path, password)
+        except (VaultError, OSError) as e:
+            messagebox.showerror("Error", f"Cannot open vault: {str(e)}")
+            return
+
+        # Only metadata is decrypted here; secrets wait until a row is shown
+        for entry_id, meta in self.vault.entries():
+            account = Account(meta["account"], meta.get("issuer"), meta["algorithm"], meta["digits"],
+                              meta["period"], lambda entry_id=entry_id: self.vault.get(entry_id).secret, entry_id)
+            self._insert(account)
+        self._accounts_changed()
+
+    def _insert(self, account):
+        item = self.tree.insert("", tk.END, values=(account.issuer, account.account, account.placeholder, ""))
+        self.accounts[item] = account
+        return item
+
+    def _accounts_changed(self):
+        where = "in vault" if self.vault else "in memory"
+        self.status_label.config(text=f"✓ {len(self.accounts)} account(s) secured {where}", foreground="green")
+        self.scheduler.set_periods(a.period for a in self.accounts.values())
+
+    def add_uri(self, data):
+        """Parse an otpauth:// URI and add it as an account"""
+        try:
+            uri = parse_otpauth_uri(data)
+            entry_id = self.vault.add(uri) if self.vault else None
+        except Exception as e:
+            messagebox.showerror("Error", f"Error processing QR code: {str(e)}")
+            self.status_label.config(text="✗ Error processing QR code", foreground="red")
+            return None
+
+        item = self._insert(Account.from_uri(uri, entry_id))
+        self._accounts_changed()
+        return item
+
+    def select_file(self):
+        """Add accounts from one or more QR code images"""
+        paths = filedialog.askopenfilenames(filetypes=[("Image files", "*.png *.jpg *.jpeg *.bmp *.gif")])
+        if not paths:
+            return
+        # OpenCV is only imported once a QR code is actually needed
+        from totp_qr_ingest import decode_file
+
+        for path in paths:
+            try:
+                self.add_uri(decode_file(path)[0])
+            except Exception as e:
+                messagebox.showerror("Error", f"Error processing image: {str(e)}")
+
+    def scan_qr(self):
+        """Add an account by scanning a QR code with the camera"""
+        try:
+            from totp_qr_ingest import scan_camera
+
+            data = scan_camera()
+            if data:
+                self.add_uri(data)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+        except Exception as e:
+            messagebox.showerror("Error", f"Error scanning QR code: {str(e)}")
+
+    def paste_uri(self):
+        """Add an account from a pasted otpauth:// URI"""
+        data = simpledialog.askstring("Paste URI", "otpauth:// URI:", parent=self.root)
+        if data:
+            self.add_uri(data.strip())
+
+    def remove_selected(self):
+        for item in self.tree.selection():
+            account = self.accounts.pop(item, None)
+            self.tree.delete(item)
+            if self.vault and account and account.entry_id:
+                self.vault.remove(account.entry_id)
+        if self.vault and self.vault.needs_compaction():
+            self.vault.compact()
+        self._accounts_changed()
+
+    def refresh_codes(self, periods, now):
+        """Expire the codes of every account whose period just rolled over"""
+        for item, account in self.accounts.items():
+            if account.period in periods and account.step is not None:
+                account.step = None
+                self.tree.set(item, "code", account.placeholder)
+        # Visible rows are recomputed now, hidden ones when scrolled into view
+        self.redraw_visible(now)
+
+    def visible_items(self):
+        """Yield the tree items currently scrolled into view"""
+        children = self.tree.get_children()
+        if not children:
+            return
+        # The first visible row follows from the scroll position
+        index = max(min(int(self.tree.yview()[0] * len(children)), len(children) - 1) - 1, 0)
+        while index < len(children) and not self.tree.bbox(children[index]):
+            index += 1
+        for item in children[index:]:
+            if not self.tree.bbox(item):
+                return
+            yield item
+
+    def redraw_visible(self, now):
+        """Update the code and countdown of visible rows only"""
+        for item in self.visible_items():
+            account = self.accounts.get(item)
+            if account is None:
+                continue
+            step = int(now // account.period)
+            if account.step != step:
+                account.step = step
+                self.tree.set(item, "code", account.totp.at(now))
+            remaining = f"{int(account.period - now % account.period)}s"
+            if self.tree.set(item, "remaining") != remaining:
+                self.tree.set(item, "remaining", remaining)
+
+if __name__ == "__main__":
+    root = tk.Tk()
+    app = MultiAccountAuthenticator(root)
+    root.after_idle(prewarm, "totp_qr_ingest")
+    root.mainloop()
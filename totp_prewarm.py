@@ -0,0 +1,32 @@
+"""Background imports for the desktop apps' heavy optional stacks
+
+The desktop apps import OpenCV, pyzbar, qrcode and PIL on first use, so
+their window appears without waiting for them. Once the window is up,
+prewarm() imports them on a daemon thread so that the first scan or QR
+render does not pay for it either:
+
+    root.after_idle(prewarm, "totp_qr_ingest")
+
+Set TOTP_PREWARM=0 to skip this, e.g. on thin clients that never scan.
+"""
+import importlib
+import os
+import threading
+
+
+def _import_all(modules):
+    for name in modules:
+        try:
+            importlib.import_module(name)
+        except Exception:
+            # Reported when the feature is actually used
+            pass
+
+
+def prewarm(*modules):
+    """Import modules on a daemon thread and return it, or None if disabled"""
+    if os.environ.get("TOTP_PREWARM", "1") == "0":
+        return None
+    thread = threading.Thread(target=_import_all, args=(modules,), name="totp-prewarm", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,205 @@
+"""Headless TOTP provisioning: secrets, otpauth:// URIs and QR images
+
+    python totp_provision.py roster.csv --issuer Acme --output qr_out
+    python totp_provision.py roster.csv --format svg --zip onboarding.zip
+    python totp_provision.py roster.csv --issuer Acme --algorithm SHA256 --digits 8 --output qr_out
+
+The roster is a CSV of account[,issuer] rows (an optional header row is
+skipped). Images are rendered across a process pool and written either into
+a directory sharded by a hash of the account name, or into a single zip.
+A manifest.ndjson with one {"user_id", "uri", "file"} record per account is
+written alongside, and can be fed straight to `totp_enroll.py import
+--format ndjson`. The manifest contains secrets; protect it accordingly.
+"""
+import argparse
+import csv
+import hashlib
+import io
+import json
+import os
+import re
+import sys
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+import pyotp
+import qrcode
+import qrcode.image.svg
+
+from totp_uri import ALGORITHMS, OTPAuthURI
+
+IMAGE_FORMATS = ("png", "svg")
+
+
+def safe_filename(name):
+    """Reduce an account name to a filesystem-safe file stem"""
+    stem = re.sub(r"[^A-Za-z0-9._@-]+", "_", name).strip("._")
+    return stem[:100] or "account"
+
+
+def build_qr(uri, mask_pattern=None):
+    """Build the QR code object for a provisioning URI
+
+    A fixed mask_pattern (0-7) skips qrcode's search for the best mask, which
+    is most of the cost of building a code.
+    """
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+        mask_pattern=mask_pattern,
+    )
+    qr.add_data(uri)
+    qr.make(fit=True)
+    return qr
+
+
+def render_qr(uri, image_format="png", mask_pattern=None):
+    """Render a provisioning URI as PNG or SVG bytes"""
+    qr = build_qr(uri, mask_pattern)
+    buffer = io.BytesIO()
+    if image_format == "svg":
+        qr.make_image(image_factory=qrcode.image.svg.SvgPathImage).save(buffer)
+    else:
+        qr.make_image(fill_color="black", back_color="white").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def new_credential(account, issuer, algorithm="SHA1", digits=6, period=30):
+    """Generate a random secret and its provisioning URI"""
+    if not account or not issuer:
+        raise ValueError("Please fill in all fields")
+    # SHA256 and SHA512 keys get the full block of entropy instead of 160 bits
+    secret = pyotp.random_base32(32 if algorithm == "SHA1" else 64)
+    uri = OTPAuthURI(secret, account, issuer, algorithm, digits, period).to_uri()
+    return secret, uri
+
+
+def shard_path(account, image_format):
+    """Relative output path for an account, sharded by a hash of its name"""
+    shard = hashlib.sha1(account.encode("utf-8")).hexdigest()[:2]
+    return f"{shard}/totp_qr_{safe_filename(account)}.{image_format}"
+
+
+def provision_account(account, issuer, image_format="png", mask_pattern=None, params=None):
+    """Create a credential and its QR image for one account
+
+    params holds optional algorithm, digits and period for new_credential.
+    """
+    secret, uri = new_credential(account, issuer, **(params or {}))
+    return {
+        "user_id": account,
+        "issuer": issuer,
+        "secret": secret,
+        "uri": uri,
+        "file": shard_path(account, image_format),
+        "image": render_qr(uri, image_format, mask_pattern),
+    }
+
+
+def _provision_chunk(rows, image_format, mask_pattern, params):
+    results = []
+    for account, issuer in rows:
+        try:
+            results.append(provision_account(account, issuer, image_format, mask_pattern, params))
+        except Exception as e:
+            results.append({"user_id": account, "error": str(e)})
+    return results
+
+
+def provision_roster(rows, output=None, zip_path=None, image_format="png", mask_pattern=None, workers=None, chunk_size=200,
+                     params=None):
+    """Provision every (account, issuer) row and write images plus manifest
+
+    Exactly one of output (a directory) or zip_path must be given. Returns
+    counts of provisioned and failed rows.
+    """
+    if (output is None) == (zip_path is None):
+        raise ValueError("Give exactly one of output or zip_path")
+
+    rows = list(rows)
+    chunks = [rows[i:i + chunk_size] for i in range(0, len(rows), chunk_size)]
+    archive = zipfile.ZipFile(zip_path, "w", zipfile.ZIP_STORED) if zip_path else None
+    if output:
+        os.makedirs(output, exist_ok=True)
+    manifest = io.StringIO() if archive else open(os.path.join(output, "manifest.ndjson"), "w", encoding="utf-8")
+
+    provisioned = failed = 0
+    seen = set()
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for results in pool.map(_provision_chunk, chunks, [image_format] * len(chunks), [mask_pattern] * len(chunks),
+                                    [params] * len(chunks)):
+                for result in results:
+                    if "error" in result or result["file"] in seen:
+                        failed += 1
+                        error = result.get("error", "Duplicate account or file name")
+                        print(f"{result['user_id']}: {error}", file=sys.stderr)
+                        continue
+                    seen.add(result["file"])
+
+                    # PNG and SVG data gain nothing from deflate, so store as-is
+                    if archive:
+                        archive.writestr(result["file"], result["image"])
+                    else:
+                        path = os.path.join(output, result["file"])
+                        os.makedirs(os.path.dirname(path), exist_ok=True)
+                        with open(path, "wb") as f:
+                            f.write(result["image"])
+
+                    manifest.write(json.dumps({"user_id": result["user_id"], "uri": result["uri"], "file": result["file"]}) + "\n")
+                    provisioned += 1
+        if archive:
+            archive.writestr("manifest.ndjson", manifest.getvalue())
+    finally:
+        manifest.close()
+        if archive:
+            archive.close()
+
+    return {"provisioned": provisioned, "failed": failed}
+
+
+def read_roster(lines, default_issuer=None):
+    """Yield (account, issuer) pairs from account[,issuer] CSV lines"""
+    for line_no, row in enumerate(csv.reader(lines), 1):
+        if not row or (line_no == 1 and row[0].strip().lower() in ("account", "user_id")):
+            continue
+        account = row[0].strip()
+        issuer = row[1].strip() if len(row) > 1 and row[1].strip() else default_issuer
+        yield account, issuer
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate TOTP secrets and QR codes for a roster of accounts")
+    parser.add_argument("roster", help="CSV of account[,issuer] rows, or - for stdin")
+    parser.add_argument("--issuer", help="issuer for rows that do not name one")
+    parser.add_argument("--format", choices=IMAGE_FORMATS, default="png", help="QR image format")
+    destination = parser.add_mutually_exclusive_group(required=True)
+    destination.add_argument("--output", help="output directory (sharded by account hash)")
+    destination.add_argument("--zip", help="write everything into this zip file instead")
+    parser.add_argument("--mask", type=int, choices=range(8), metavar="0-7",
+                        help="fixed QR mask pattern; skips the best-mask search (about 3x faster)")
+    parser.add_argument("--workers", type=int, help="rendering processes (default: CPU count)")
+    parser.add_argument("--algorithm", choices=ALGORITHMS, default="SHA1", help="HMAC algorithm")
+    parser.add_argument("--digits", type=int, choices=range(6, 11), metavar="6-10", default=6, help="code length")
+    parser.add_argument("--period", type=int, default=30, help="time step in seconds")
+    args = parser.parse_args(argv)
+    if args.period <= 0:
+        parser.error("--period must be positive")
+
+    source = sys.stdin if args.roster == "-" else open(args.roster, newline="", encoding="utf-8")
+    try:
+        rows = list(read_roster(source, args.issuer))
+    finally:
+        if source is not sys.stdin:
+            source.close()
+
+    summary = provision_roster(rows, output=args.output, zip_path=args.zip,
+                               image_format=args.format, mask_pattern=args.mask, workers=args.workers,
+                               params={"algorithm": args.algorithm, "digits": args.digits, "period": args.period})
+    print(json.dumps(summary))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,7 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
-import qrcode
-import pyotp
-import base64
-from PIL import Image, ImageTk
-import secrets
-import os
+
+from totp_prewarm import prewarm
 
 class TOTPQRGenerator:
     def __init__(self, root):
@@ -49,32 +45,19 @@ class TOTPQRGenerator:
     def generate_qr(self):
         """Generate new TOTP secret and QR code"""
         try:
-            # Generate random secret
-            secret = pyotp.random_base32()
-            
+            # qrcode and PIL are only imported once a code is generated
+            from PIL import ImageTk
+            from totp_provision import build_qr, new_credential, safe_filename
+
             # Get account details
             account = self.account_entry.get().strip()
             issuer = self.issuer_entry.get().strip()
             
-            if not account or not issuer:
-                raise ValueError("Please fill in all fields")
-            
-            # Generate OTP URI
-            totp = pyotp.TOTP(secret)
-            provisioning_uri = totp.provisioning_uri(
-                name=account,
-                issuer_name=issuer
-            )
+            # Generate random secret and OTP URI
+            secret, provisioning_uri = new_credential(account, issuer)
             
             # Generate QR code
-            qr = qrcode.QRCode(
-                version=1,
-                error_correction=qrcode.constants.ERROR_CORRECT_L,
-                box_size=10,
-                border=4,
-            )
-            qr.add_data(provisioning_uri)
-            qr.make(fit=True)
+            qr = build_qr(provisioning_uri)
             
             # Create QR code image
             qr_image = qr.make_image(fill_color="black", back_color="white")
@@ -88,7 +71,7 @@ class TOTPQRGenerator:
             self.secret_label.config(text=f"Secret: {secret}")
             
             # Save QR code
-            save_path = f"totp_qr_{account}.png"
+            save_path = f"totp_qr_{safe_filename(account)}.png"
             qr_image.save(save_path)
             messagebox.showinfo("Success", f"QR code saved as {save_path}")
             
@@ -98,4 +81,5 @@ class TOTPQRGenerator:
 if __name__ == "__main__":
     root = tk.Tk()
     app = TOTPQRGenerator(root)
+    root.after_idle(prewarm, "PIL.ImageTk", "totp_provision")
     root.mainloop()
\ No newline at end of file
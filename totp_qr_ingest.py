@@ -0,0 +1,196 @@
+"""Shared QR ingest for the desktop clients
+
+Decoding tries pyzbar first and falls back to OpenCV's QRCodeDetector and,
+where available, its ArUco-based detector, so either library alone is
+enough. Camera frames are decoded on a worker thread that only ever holds
+the latest frame, skips frames while busy, and looks at a downscaled centre
+region before trying the whole frame:
+
+    worker = QRScanWorker(on_result=handle_uri)
+    worker.start()
+    worker.submit(frame)        # from the capture loop, never blocks
+
+Whole directories of exported QR images can be decoded in parallel with
+decode_directory(), and decoded text is parsed with totp_uri.
+"""
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+
+from totp_uri import parse_otpauth_uri
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".gif")
+
+try:
+    from pyzbar.pyzbar import decode as _zbar_decode
+except ImportError:
+    # pyzbar or the zbar shared library is missing; OpenCV still works
+    _zbar_decode = None
+
+_detector = threading.local()
+
+
+def _opencv_detectors():
+    # Detectors are not thread-safe, so keep one set per thread
+    detectors = getattr(_detector, "instances", None)
+    if detectors is None:
+        detectors = [cv2.QRCodeDetector()]
+        if hasattr(cv2, "QRCodeDetectorAruco"):
+            detectors.append(cv2.QRCodeDetectorAruco())
+        _detector.instances = detectors
+    return detectors
+
+
+def _opencv_decode(gray):
+    for detector in _opencv_detectors():
+        data, _, _ = detector.detectAndDecode(gray)
+        if data:
+            return [data]
+    return []
+
+
+def decode_image(image):
+    """Return the text of every QR code found in a BGR or grayscale image"""
+    if image is None:
+        return []
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+
+    if _zbar_decode is not None:
+        results = [obj.data.decode("utf-8") for obj in _zbar_decode(gray)]
+        if results:
+            return results
+    return _opencv_decode(gray)
+
+
+def decode_file(path):
+    """Decode the QR codes in an image file, raising ValueError if there are none"""
+    image = cv2.imread(path)
+    if image is None:
+        raise ValueError("Cannot read image file")
+    results = decode_image(image)
+    if not results:
+        raise ValueError("No QR code found in image")
+    return results
+
+
+def read_otpauth_file(path):
+    """Decode an image file and parse its first QR code as an otpauth:// URI"""
+    return parse_otpauth_uri(decode_file(path)[0])
+
+
+def _decode_path(path):
+    try:
+        return path, decode_file(path), None
+    except Exception as e:
+        return path, [], str(e)
+
+
+def decode_directory(directory, workers=None):
+    """Yield (path, texts, error) for every image in a directory, decoded in parallel"""
+    paths = sorted(
+        os.path.join(directory, name)
+        for name in os.listdir(directory)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from pool.map(_decode_path, paths, chunksize=16)
+
+
+def region_of_interest(frame, max_width=640, crop=0.75):
+    """Return the centre crop of a frame, downscaled to at most max_width pixels wide"""
+    height, width = frame.shape[:2]
+    crop_w, crop_h = int(width * crop), int(height * crop)
+    x, y = (width - crop_w) // 2, (height - crop_h) // 2
+    roi = frame[y:y + crop_h, x:x + crop_w]
+    if crop_w > max_width:
+        scale = max_width / crop_w
+        roi = cv2.resize(roi, (max_width, int(crop_h * scale)), interpolation=cv2.INTER_AREA)
+    return roi
+
+
+class QRScanWorker(threading.Thread):
+    """Decode camera frames off the UI thread
+
+    submit() stores only the most recent frame, so frames arriving while a
+    decode is running are dropped. Only every `skip`-th submitted frame is
+    considered at all, and every `full_frame_every`-th decode also tries the
+    full-resolution frame for codes outside the centre region. on_result is
+    called from the worker thread with the first decoded text; Tk callers
+    should hand it to the UI with root.after().
+    """
+
+    def __init__(self, on_result, skip=2, full_frame_every=5, max_width=640):
+        super().__init__(daemon=True)
+        self.on_result = on_result
+        self.skip = skip
+        self.full_frame_every = full_frame_every
+        self.max_width = max_width
+        self._frame = None
+        self._submitted = 0
+        self._condition = threading.Condition()
+        self._stopped = False
+
+    def submit(self, frame):
+        """Offer a frame for decoding; never blocks the caller"""
+        self._submitted += 1
+        if self._submitted % self.skip:
+            return
+        with self._condition:
+            self._frame = frame
+            self._condition.notify()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+    def run(self):
+        decodes = 0
+        while True:
+            with self._condition:
+                while self._frame is None and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                frame, self._frame = self._frame, None
+
+            decodes += 1
+            results = decode_image(region_of_interest(frame, self.max_width))
+            if not results and decodes % self.full_frame_every == 0:
+                results = decode_image(frame)
+            if results:
+                self.stop()
+                self.on_result(results[0])
+                return
+
+
+def scan_camera(device=0, window_title="Scan QR Code (Press q to quit)"):
+    """Show a camera preview until a QR code is decoded or q is pressed
+
+    Returns the decoded text, or None if the user quit. Raises ValueError if
+    the camera cannot be opened. Decoding happens on a QRScanWorker, so the
+    preview keeps up with the camera.
+    """
+    cap = cv2.VideoCapture(device)
+    if not cap.isOpened():
+        raise ValueError("Cannot access camera")
+
+    found = []
+    worker = QRScanWorker(on_result=found.append)
+    worker.start()
+    try:
+        while not found:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            worker.submit(frame)
+            cv2.imshow(window_title, frame)
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                break
+    finally:
+        worker.stop()
+        cap.release()
+        cv2.destroyAllWindows()
+    return found[0] if found else None
@@ -0,0 +1,151 @@
+import os
+import sqlite3
+import threading
+import time
+
+
+class SlidingWindowLimiter:
+    """Thread-safe sliding-window-counter rate limiter with fixed per-key state
+
+    Each key stores only the index of its current window, the request counts
+    of the current and previous windows, and when it goes idle. The
+    allowed rate is estimated by weighting the previous window's count by
+    how much of it still overlaps the sliding window, so memory and work per
+    request stay constant no matter how many requests a client makes.
+    """
+
+    def __init__(self, evict_interval=60.0):
+        self.evict_interval = evict_interval
+        self._state = {}
+        self._lock = threading.Lock()
+        self._next_eviction = time.monotonic() + evict_interval
+
+    def hit(self, key, limit, window, now=None):
+        """Record a request for key and return True if it is within the limit"""
+        if now is None:
+            now = time.time()
+        index = int(now // window)
+        elapsed = (now % window) / window
+
+        with self._lock:
+            self._maybe_evict(now)
+
+            state = self._state.get(key)
+            if state is None:
+                state = self._state[key] = [index, 0, 0, 0.0]
+            elif state[0] != index:
+                # Roll the window; counts older than one window are dropped
+                state[2] = state[1] if state[0] == index - 1 else 0
+                state[1] = 0
+                state[0] = index
+            # Once both windows have passed, the key carries no information
+            state[3] = now + 2 * window
+
+            if state[2] * (1 - elapsed) + state[1] >= limit:
+                return False
+            state[1] += 1
+            return True
+
+    def _maybe_evict(self, now):
+        """Drop keys idle for longer than two of their windows (called with the lock held)"""
+        monotonic = time.monotonic()
+        if monotonic < self._next_eviction:
+            return
+        self._next_eviction = monotonic + self.evict_interval
+        for key in [k for k, state in self._state.items() if state[3] < now]:
+            del self._state[key]
+
+    def __len__(self):
+        return len(self._state)
+
+
+class SQLiteRateLimiter:
+    """Sliding-window-counter limiter whose state is shared between processes"""
+
+    _SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS rate_limits ("
+        " key TEXT PRIMARY KEY NOT NULL,"
+        " window_index INTEGER NOT NULL,"
+        " current INTEGER NOT NULL,"
+        " previous INTEGER NOT NULL,"
+        " expires_at REAL NOT NULL"
+        ") WITHOUT ROWID"
+    )
+    _SELECT = "SELECT window_index, current, previous FROM rate_limits WHERE key = ?"
+    _UPSERT = (
+        "INSERT INTO rate_limits (key, window_index, current, previous, expires_at) VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT(key) DO UPDATE SET window_index = excluded.window_index, current = excluded.current, "
+        "previous = excluded.previous, expires_at = excluded.expires_at"
+    )
+    _EVICT = "DELETE FROM rate_limits WHERE expires_at < ?"
+    _COUNT = "SELECT COUNT(*) FROM rate_limits"
+
+    def __init__(self, path, evict_interval=60.0, timeout=5.0):
+        self.path = path
+        self.evict_interval = evict_interval
+        self.timeout = timeout
+        self._local = threading.local()
+        self._next_eviction = time.monotonic() + evict_interval
+
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(self._SCHEMA)
+        conn.commit()
+
+    def _connection(self):
+        """Return this thread's connection, opening it on first use"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit mode so BEGIN IMMEDIATE controls the transaction
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def hit(self, key, limit, window, now=None):
+        """Record a request for key and return True if it is within the limit"""
+        if now is None:
+            now = time.time()
+        index = int(now // window)
+        elapsed = (now % window) / window
+
+        conn = self._connection()
+        # Take the write lock up front so concurrent workers cannot both pass
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if time.monotonic() >= self._next_eviction:
+                self._next_eviction = time.monotonic() + self.evict_interval
+                conn.execute(self._EVICT, (now,))
+
+            row = conn.execute(self._SELECT, (key,)).fetchone()
+            current, previous = 0, 0
+            if row is not None:
+                if row[0] == index:
+                    current, previous = row[1], row[2]
+                elif row[0] == index - 1:
+                    previous = row[1]
+
+            allowed = previous * (1 - elapsed) + current < limit
+            if allowed:
+                current += 1
+            conn.execute(self._UPSERT, (key, index, current, previous, now + 2 * window))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return allowed
+
+    def __len__(self):
+        return self._connection().execute(self._COUNT).fetchone()[0]
+
+
+def create_limiter(path=None):
+    """Build the rate limiter, shared through SQLite when a path is given
+
+    The path falls back to the TOTP_RATE_LIMIT_PATH environment variable;
+    without one, limits are tracked in process memory.
+    """
+    path = path or os.environ.get("TOTP_RATE_LIMIT_PATH")
+    if path:
+        return SQLiteRateLimiter(path)
+    return SlidingWindowLimiter()
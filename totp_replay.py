@@ -0,0 +1,148 @@
+"""Replay protection for accepted TOTP codes
+
+ReplayGuard remembers the last accepted time step of each user in a fixed
+size open-addressing hash table stored in an mmap. Each slot is 16 bytes
+(an 8-byte hash of the user_id and an 8-byte step), so the memory cost is
+exactly capacity * 16 bytes: 16 MiB for the default capacity of 1M users,
+independent of request volume.
+
+With a path (e.g. under /dev/shm), the table is file-backed and shared by
+every worker process that opens the same path; updates are serialized with
+an fcntl lock. Size capacity above the number of users that verify within
+a few time steps: once a probe run is full, the slot with the oldest step is
+overwritten, and only slots that are still within the ±1 window matter.
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+
+_SLOT = struct.Struct("<QQ")
+SLOT_SIZE = _SLOT.size
+
+
+class ReplayGuard:
+    """Reject codes whose time step is not newer than the user's last accepted step"""
+
+    def __init__(self, capacity=1 << 20, path=None, max_probe=32):
+        self.path = path
+        self.max_probe = max_probe
+        self._lock = threading.Lock()
+        self._fd = None
+
+        if path:
+            self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            with self._file_lock():
+                size = os.fstat(self._fd).st_size
+                if size < SLOT_SIZE:
+                    size = capacity * SLOT_SIZE
+                    os.ftruncate(self._fd, size)
+            # An existing table keeps its size so every worker agrees on it
+            self.capacity = size // SLOT_SIZE
+            self._map = mmap.mmap(self._fd, self.capacity * SLOT_SIZE)
+        else:
+            self.capacity = capacity
+            self._map = mmap.mmap(-1, capacity * SLOT_SIZE)
+
+    def _file_lock(self):
+        return _FileLock(self._fd)
+
+    @staticmethod
+    def _key(user_id):
+        key = int.from_bytes(hashlib.blake2b(str(user_id).encode("utf-8"), digest_size=8).digest(), "little")
+        # Zero marks an empty slot
+        return key or 1
+
+    def check_and_record(self, user_id, step):
+        """Record step for user_id and return True if it is newer than the last accepted one"""
+        key = self._key(user_id)
+        start = key % self.capacity
+
+        with self._lock, self._file_lock():
+            victim, victim_step = None, None
+            for probe in range(min(self.max_probe, self.capacity)):
+                offset = ((start + probe) % self.capacity) * SLOT_SIZE
+                slot_key, slot_step = _SLOT.unpack_from(self._map, offset)
+                if slot_key == key:
+                    if step <= slot_step:
+                        return False
+                    _SLOT.pack_into(self._map, offset, key, step)
+                    return True
+                if slot_key == 0:
+                    _SLOT.pack_into(self._map, offset, key, step)
+                    return True
+                if victim is None or slot_step < victim_step:
+                    victim, victim_step = offset, slot_step
+
+            # Probe run is full: reuse the slot holding the oldest step
+            _SLOT.pack_into(self._map, victim, key, step)
+            return True
+
+    def forget(self, user_id):
+        """Accept any step for user_id again, e.g. after its credential changed
+
+        Steps depend on the credential's period, so the old last step means
+        nothing for a new credential. The slot keeps its key with step 0, so
+        probe runs through it stay intact, and it is the first to be reused.
+        """
+        key = self._key(user_id)
+        start = key % self.capacity
+        with self._lock, self._file_lock():
+            for probe in range(min(self.max_probe, self.capacity)):
+                offset = ((start + probe) % self.capacity) * SLOT_SIZE
+                slot_key, _ = _SLOT.unpack_from(self._map, offset)
+                if slot_key == key:
+                    _SLOT.pack_into(self._map, offset, key, 0)
+                    return
+                if slot_key == 0:
+                    return
+
+    def last_step(self, user_id):
+        """Return the last accepted step for user_id, or None"""
+        key = self._key(user_id)
+        start = key % self.capacity
+        for probe in range(min(self.max_probe, self.capacity)):
+            offset = ((start + probe) % self.capacity) * SLOT_SIZE
+            slot_key, slot_step = _SLOT.unpack_from(self._map, offset)
+            if slot_key == key:
+                return slot_step
+            if slot_key == 0:
+                return None
+        return None
+
+    def close(self):
+        self._map.close()
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class _FileLock:
+    """Exclusive fcntl lock on a file descriptor; a no-op without one"""
+
+    def __init__(self, fd):
+        self.fd = fd
+
+    def __enter__(self):
+        if self.fd is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self.fd is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        return False
+
+
+def create_replay_guard(path=None, capacity=None):
+    """Build the replay guard, shared between processes when a path is given
+
+    Settings fall back to the TOTP_REPLAY_PATH and TOTP_REPLAY_CAPACITY
+    environment variables.
+    """
+    path = path or os.environ.get("TOTP_REPLAY_PATH")
+    if capacity is None:
+        capacity = int(os.environ.get("TOTP_REPLAY_CAPACITY", str(1 << 20)))
+    return ReplayGuard(capacity=capacity, path=path)
@@ -0,0 +1,333 @@
+import asyncio
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+
+import pyotp
+
+from totp_uri import ALGORITHMS, DIGESTS, normalize_secret
+
+
+class Credential(namedtuple("Credential", "secret algorithm digits period")):
+    """A TOTP secret together with its algorithm, digit count and period"""
+
+    __slots__ = ()
+
+    def __new__(cls, secret, algorithm="SHA1", digits=6, period=30):
+        return super().__new__(cls, secret, algorithm, digits, period)
+
+    def totp(self):
+        return pyotp.TOTP(self.secret, digits=self.digits, digest=DIGESTS[self.algorithm], interval=self.period)
+
+
+def make_credential(secret, algorithm=None, digits=None, period=None):
+    """Validate enrollment fields and return a Credential, raising ValueError if invalid"""
+    secret = normalize_secret(secret or "")
+    algorithm = (algorithm or "SHA1").upper()
+    if algorithm not in ALGORITHMS:
+        raise ValueError(f"Unsupported algorithm: {algorithm}")
+    try:
+        digits = int(digits if digits is not None else 6)
+        period = int(period if period is not None else 30)
+    except (TypeError, ValueError):
+        raise ValueError("digits and period must be integers")
+    if not 6 <= digits <= 10:
+        raise ValueError("digits must be between 6 and 10")
+    if period <= 0:
+        raise ValueError("period must be positive")
+
+    credential = Credential(secret, algorithm, digits, period)
+    credential.totp().now()
+    return credential
+
+
+class SecretStore:
+    """Interface for TOTP credential storage backends"""
+
+    def get(self, user_id):
+        """Return the Credential for a user, or None if not enrolled"""
+        raise NotImplementedError
+
+    def put(self, user_id, credential):
+        """Store or replace the Credential for a user"""
+        raise NotImplementedError
+
+    def delete(self, user_id):
+        """Remove a user's credential"""
+        raise NotImplementedError
+
+    def put_many(self, items):
+        """Store or replace many (user_id, Credential) pairs"""
+        for user_id, credential in items:
+            self.put(user_id, credential)
+
+    def iter_credentials(self):
+        """Yield every (user_id, Credential) pair, ordered by user_id"""
+        raise NotImplementedError
+
+    def close(self):
+        """Release any resources held by the store"""
+
+
+class MemorySecretStore(SecretStore):
+    """Process-local dict store, mainly for tests and single-process demos"""
+
+    def __init__(self):
+        self._secrets = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        return self._secrets.get(user_id)
+
+    def put(self, user_id, credential):
+        with self._lock:
+            self._secrets[user_id] = credential
+
+    def delete(self, user_id):
+        with self._lock:
+            self._secrets.pop(user_id, None)
+
+    def put_many(self, items):
+        with self._lock:
+            self._secrets.update(items)
+
+    def iter_credentials(self):
+        with self._lock:
+            items = sorted(self._secrets.items())
+        yield from items
+
+
+class SQLiteSecretStore(SecretStore):
+    """SQLite-backed store that can be shared between worker processes
+
+    The database runs in WAL mode so readers never block the single writer.
+    Each call checks a connection out of a pool of at most pool_size idle
+    connections, so thread-per-request servers reuse them instead of
+    opening one per thread, and every query uses a constant SQL string so
+    sqlite3 reuses the prepared statement from its cache.
+    """
+
+    _SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS secrets ("
+        " user_id TEXT PRIMARY KEY NOT NULL,"
+        " secret TEXT NOT NULL,"
+        " updated_at REAL NOT NULL,"
+        " algorithm TEXT NOT NULL DEFAULT 'SHA1',"
+        " digits INTEGER NOT NULL DEFAULT 6,"
+        " period INTEGER NOT NULL DEFAULT 30"
+        ") WITHOUT ROWID"
+    )
+    # Columns added after the first release, with their definitions for ALTER TABLE
+    _MIGRATIONS = (
+        ("algorithm", "TEXT NOT NULL DEFAULT 'SHA1'"),
+        ("digits", "INTEGER NOT NULL DEFAULT 6"),
+        ("period", "INTEGER NOT NULL DEFAULT 30"),
+    )
+    _SELECT = "SELECT secret, algorithm, digits, period FROM secrets WHERE user_id = ?"
+    _UPSERT = (
+        "INSERT INTO secrets (user_id, secret, algorithm, digits, period, updated_at) VALUES (?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT(user_id) DO UPDATE SET secret = excluded.secret, algorithm = excluded.algorithm, "
+        "digits = excluded.digits, period = excluded.period, updated_at = excluded.updated_at"
+    )
+    _DELETE = "DELETE FROM secrets WHERE user_id = ?"
+    _SCAN = (
+        "SELECT user_id, secret, algorithm, digits, period FROM secrets "
+        "WHERE user_id > ? ORDER BY user_id LIMIT ?"
+    )
+
+    def __init__(self, path, timeout=5.0, pool_size=8):
+        self.path = path
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=pool_size)
+        self._closed = False
+
+        # Create the schema once up front; WITHOUT ROWID keys the table on user_id
+        with self._connection() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(self._SCHEMA)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(secrets)")}
+            for column, definition in self._MIGRATIONS:
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE secrets ADD COLUMN {column} {definition}")
+            conn.commit()
+
+    @contextmanager
+    def _connection(self):
+        """Check out an idle connection, or open one, and return it to the pool afterwards"""
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+        try:
+            yield conn
+        finally:
+            # Connections beyond pool_size, or returned after close(), are closed
+            try:
+                if self._closed:
+                    raise queue.Full
+                self._idle.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def get(self, user_id):
+        with self._connection() as conn:
+            row = conn.execute(self._SELECT, (user_id,)).fetchone()
+        return Credential(*row) if row else None
+
+    def put(self, user_id, credential):
+        with self._connection() as conn, conn:
+            conn.execute(self._UPSERT, (user_id, *credential, time.time()))
+
+    def delete(self, user_id):
+        with self._connection() as conn, conn:
+            conn.execute(self._DELETE, (user_id,))
+
+    def put_many(self, items):
+        """Write all pairs in a single transaction"""
+        now = time.time()
+        with self._connection() as conn, conn:
+            conn.executemany(self._UPSERT, ((user_id, *credential, now) for user_id, credential in items))
+
+    def iter_credentials(self, page_size=10000):
+        """Yield pairs page by page on the primary key, so memory stays flat"""
+        last = ""
+        while True:
+            with self._connection() as conn:
+                rows = conn.execute(self._SCAN, (last, page_size)).fetchall()
+            for row in rows:
+                yield row[0], Credential(*row[1:])
+            if len(rows) < page_size:
+                return
+            last = rows[-1][0]
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class CachedSecretStore(SecretStore):
+    """Read-through LRU cache in front of another store
+
+    Entries expire after `ttl` seconds so a secret replaced by another
+    worker process is picked up without a restart.
+    """
+
+    def __init__(self, backend, max_size=100000, ttl=60.0):
+        self.backend = backend
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and now - entry[1] < self.ttl:
+                self._entries.move_to_end(user_id)
+                return entry[0]
+
+        credential = self.backend.get(user_id)
+        if credential is not None:
+            with self._lock:
+                self._entries[user_id] = (credential, now)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return credential
+
+    def peek(self, user_id):
+        """Return the cached credential without touching the backend, or None"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+        if entry is not None and time.monotonic() - entry[1] < self.ttl:
+            return entry[0]
+        return None
+
+    def put(self, user_id, credential):
+        self.backend.put(user_id, credential)
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def delete(self, user_id):
+        self.backend.delete(user_id)
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def put_many(self, items):
+        items = list(items)
+        self.backend.put_many(items)
+        with self._lock:
+            for user_id, _ in items:
+                self._entries.pop(user_id, None)
+
+    def iter_credentials(self):
+        return self.backend.iter_credentials()
+
+    def close(self):
+        self.backend.close()
+
+
+class AsyncSecretStore:
+    """Awaitable wrapper that runs store calls in a thread pool
+
+    Lookups answered by a read-through cache return without leaving the
+    event loop; anything that may touch disk runs in the executor.
+    """
+
+    def __init__(self, store, executor=None):
+        self.store = store
+        self.executor = executor
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    async def get(self, user_id):
+        if isinstance(self.store, MemorySecretStore):
+            return self.store.get(user_id)
+        if isinstance(self.store, CachedSecretStore):
+            credential = self.store.peek(user_id)
+            if credential is not None:
+                return credential
+        return await self._run(self.store.get, user_id)
+
+    async def put(self, user_id, credential):
+        await self._run(self.store.put, user_id, credential)
+
+    async def delete(self, user_id):
+        await self._run(self.store.delete, user_id)
+
+    async def close(self):
+        await self._run(self.store.close)
+
+
+def create_store(path=None, cache_size=None, cache_ttl=None):
+    """Build the configured store, defaulting to SQLite with a read-through cache
+
+    Settings fall back to the TOTP_STORE_PATH, TOTP_STORE_CACHE_SIZE and
+    TOTP_STORE_CACHE_TTL environment variables. A path of ":memory:" selects
+    the process-local dict store; a cache size of 0 disables the cache.
+    """
+    path = path or os.environ.get("TOTP_STORE_PATH", "totp_secrets.db")
+    if cache_size is None:
+        cache_size = int(os.environ.get("TOTP_STORE_CACHE_SIZE", "100000"))
+    if cache_ttl is None:
+        cache_ttl = float(os.environ.get("TOTP_STORE_CACHE_TTL", "60"))
+
+    if path == ":memory:":
+        return MemorySecretStore()
+
+    store = SQLiteSecretStore(path)
+    if cache_size > 0:
+        store = CachedSecretStore(store, max_size=cache_size, ttl=cache_ttl)
+    return store
@@ -0,0 +1,95 @@
+"""Parsing and building of otpauth:// provisioning URIs
+
+Follows the Key Uri Format used by Google Authenticator:
+
+    otpauth://totp/Issuer:account?secret=BASE32&issuer=Issuer&algorithm=SHA1&digits=6&period=30
+"""
+import base64
+import hashlib
+from urllib.parse import parse_qs, quote, unquote, urlencode, urlsplit
+
+import pyotp
+
+ALGORITHMS = ("SHA1", "SHA256", "SHA512")
+DIGESTS = {"SHA1": hashlib.sha1, "SHA256": hashlib.sha256, "SHA512": hashlib.sha512}
+
+
+class OTPAuthURI:
+    """Fields of a parsed otpauth:// URI"""
+
+    def __init__(self, secret, account="", issuer=None, algorithm="SHA1", digits=6, period=30, type="totp"):
+        self.secret = secret
+        self.account = account
+        self.issuer = issuer
+        self.algorithm = algorithm
+        self.digits = digits
+        self.period = period
+        self.type = type
+
+    def totp(self):
+        """Return a pyotp.TOTP honouring the algorithm, digits and period"""
+        return pyotp.TOTP(self.secret, digits=self.digits, digest=DIGESTS[self.algorithm], interval=self.period)
+
+    def to_uri(self):
+        """Build the otpauth:// URI for these fields"""
+        label = quote(f"{self.issuer}:{self.account}" if self.issuer else self.account, safe=":@")
+        params = {"secret": self.secret}
+        if self.issuer:
+            params["issuer"] = self.issuer
+        if self.algorithm != "SHA1":
+            params["algorithm"] = self.algorithm
+        if self.digits != 6:
+            params["digits"] = self.digits
+        if self.period != 30:
+            params["period"] = self.period
+        return f"otpauth://{self.type}/{label}?{urlencode(params, quote_via=quote)}"
+
+    def __repr__(self):
+        return f"OTPAuthURI(account={self.account!r}, issuer={self.issuer!r}, algorithm={self.algorithm!r}, digits={self.digits}, period={self.period})"
+
+
+def normalize_secret(secret):
+    """Upper-case a base32 secret, strip spaces and padding, and check that it decodes"""
+    secret = secret.replace(" ", "").upper().rstrip("=")
+    if not secret:
+        raise ValueError("Empty secret")
+    try:
+        base64.b32decode(secret + "=" * (-len(secret) % 8))
+    except Exception:
+        raise ValueError("Invalid secret encoding")
+    return secret
+
+
+def parse_otpauth_uri(uri):
+    """Parse an otpauth://totp/ URI into an OTPAuthURI, raising ValueError if invalid"""
+    parts = urlsplit(uri.strip())
+    if parts.scheme != "otpauth":
+        raise ValueError("Invalid OTP URI format")
+    if parts.netloc != "totp":
+        raise ValueError(f"Unsupported OTP type: {parts.netloc or 'missing'}")
+
+    params = {key: values[0] for key, values in parse_qs(parts.query).items()}
+    if "secret" not in params:
+        raise ValueError("No valid secret found in QR code")
+    secret = normalize_secret(params["secret"])
+
+    # Label is "issuer:account" or just "account"
+    label = unquote(parts.path.lstrip("/"))
+    issuer, _, account = label.rpartition(":")
+    issuer = params.get("issuer") or issuer.strip() or None
+
+    algorithm = params.get("algorithm", "SHA1").upper()
+    if algorithm not in ALGORITHMS:
+        raise ValueError(f"Unsupported algorithm: {algorithm}")
+
+    try:
+        digits = int(params.get("digits", 6))
+        period = int(params.get("period", 30))
+    except ValueError:
+        raise ValueError("digits and period must be integers")
+    if not 6 <= digits <= 10:
+        raise ValueError("digits must be between 6 and 10")
+    if period <= 0:
+        raise ValueError("period must be positive")
+
+    return OTPAuthURI(secret, account.strip(), issuer, algorithm, digits, period)
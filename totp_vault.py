@@ -0,0 +1,264 @@
+"""Encrypted on-disk vault for client TOTP secrets
+
+The vault is an append-only file:
+
+    header   magic, KDF cost (log2 N, r, p), salt, and an AEAD check tag
+    records  op, entry id, then an encrypted metadata blob and an
+             encrypted secret blob, each with its own random nonce
+
+The key is derived with scrypt, which is memory-hard; its cost is stored in
+the header and tunable at creation. Every blob is sealed with AES-256-GCM,
+bound to its record's op and entry id. Unlocking derives the key once and
+scans the fixed-size record frames to build an in-memory index of offsets,
+without decrypting anything. Metadata (account, issuer, parameters) is
+decrypted when listed and secrets only when asked for.
+
+Adding or removing an entry appends one record and fsyncs; nothing is ever
+rewritten in place. Delete records carry an empty sealed blob, so a
+tombstone cannot be forged without the key. A record that runs past the end
+of the file (a crash during an append) is ignored and cut off by the next
+write; any other damaged frame raises VaultError rather than being
+discarded. compact() drops deleted and superseded records by writing a new
+file and atomically replacing the old one.
+"""
+import hashlib
+import json
+import os
+import struct
+import uuid
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from totp_uri import OTPAuthURI
+
+MAGIC = b"TOTPVLT1"
+# Version 2 seals delete records; version 1 files are not readable
+VERSION = 2
+_HEADER = struct.Struct(">8sBBBB16s12s16s")
+_FRAME = struct.Struct(">B16sII")
+# Magic, version, KDF cost and salt; authenticated by the check tag
+_PREFIX_SIZE = 28
+_NONCE_SIZE = 12
+
+OP_PUT = 1
+OP_DELETE = 2
+
+# Largest blob a frame may declare; anything bigger is a damaged length field
+MAX_BLOB_SIZE = 1 << 16
+
+# Defaults cost about 32 MiB and ~100 ms on a desktop CPU
+DEFAULT_LOG2_N = 15
+DEFAULT_R = 8
+DEFAULT_P = 1
+
+
+class VaultError(Exception):
+    """Raised for a wrong password or a damaged vault file"""
+
+
+def _derive_key(password, salt, log2_n, r, p):
+    return hashlib.scrypt(
+        password.encode("utf-8"), salt=salt, n=1 << log2_n, r=r, p=p,
+        maxmem=256 * r * (1 << log2_n) + (1 << 20), dklen=32,
+    )
+
+
+def _seal(aead, plaintext, aad):
+    nonce = os.urandom(_NONCE_SIZE)
+    return nonce + aead.encrypt(nonce, plaintext, aad)
+
+
+def _open(aead, blob, aad):
+    try:
+        return aead.decrypt(blob[:_NONCE_SIZE], blob[_NONCE_SIZE:], aad)
+    except (InvalidTag, ValueError):
+        # ValueError: a blob too short to hold a nonce
+        raise VaultError("Vault entry failed authentication")
+
+
+class Vault:
+    """Append-only encrypted store of otpauth credentials"""
+
+    def __init__(self, path, aead, header, index, end, dead):
+        self.path = path
+        self._aead = aead
+        self._header = header
+        self._index = index
+        self._end = end
+        self._dead = dead
+        self._meta = {}
+
+    @classmethod
+    def create(cls, path, password, log2_n=DEFAULT_LOG2_N, r=DEFAULT_R, p=DEFAULT_P):
+        """Create a new, empty vault; fails if the file already exists"""
+        salt = os.urandom(16)
+        aead = AESGCM(_derive_key(password, salt, log2_n, r, p))
+        prefix = MAGIC + bytes([VERSION, log2_n, r, p]) + salt
+        check = _seal(aead, b"", prefix)
+        header = prefix + check
+
+        with open(path, "xb") as f:
+            f.write(header)
+            f.flush()
+            os.fsync(f.fileno())
+        return cls(path, aead, header, {}, len(header), 0)
+
+    @classmethod
+    def open(cls, path, password):
+        """Unlock an existing vault and index its records"""
+        with open(path, "rb") as f:
+            header = f.read(_HEADER.size)
+            if len(header) != _HEADER.size:
+                raise VaultError("Not a TOTP vault")
+            magic, version, log2_n, r, p, salt, nonce, tag = _HEADER.unpack(header)
+            if magic != MAGIC:
+                raise VaultError("Not a TOTP vault")
+            if version != VERSION:
+                raise VaultError(f"Unsupported vault version {version} (expected {VERSION})")
+
+            aead = AESGCM(_derive_key(password, salt, log2_n, r, p))
+            try:
+                aead.decrypt(nonce, tag, header[:_PREFIX_SIZE])
+            except InvalidTag:
+                raise VaultError("Wrong password")
+
+            index, end, dead = cls._scan(f, len(header), aead)
+        return cls(path, aead, header, index, end, dead)
+
+    @classmethod
+    def _scan(cls, f, offset, aead):
+        """Build {entry_id: (meta_offset, meta_len, data_offset, data_len)} from record frames
+
+        Only put blobs are left sealed; tombstones are authenticated here,
+        as they are never read again.
+        """
+        index = {}
+        dead = 0
+        size = os.fstat(f.fileno()).st_size
+        while offset + _FRAME.size <= size:
+            f.seek(offset)
+            op, entry_id, meta_len, data_len = _FRAME.unpack(f.read(_FRAME.size))
+            if op not in (OP_PUT, OP_DELETE) or meta_len > MAX_BLOB_SIZE or data_len > MAX_BLOB_SIZE:
+                raise VaultError(f"Vault is damaged at offset {offset}")
+            record_end = offset + _FRAME.size + meta_len + data_len
+            if record_end > size:
+                # Torn tail from an interrupted append
+                break
+            if entry_id in index:
+                dead += 1
+            if op == OP_PUT:
+                meta_offset = offset + _FRAME.size
+                index[entry_id] = (meta_offset, meta_len, meta_offset + meta_len, data_len)
+            else:
+                _open(aead, f.read(meta_len), cls._aad(OP_DELETE, entry_id, b""))
+                index.pop(entry_id, None)
+                dead += 1
+            offset = record_end
+        return index, offset, dead
+
+    @staticmethod
+    def _aad(op, entry_id, part):
+        return bytes([op]) + entry_id + part
+
+    def _read(self, offset, length):
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def _append(self, op, entry_id, meta=b"", data=b""):
+        frame = _FRAME.pack(op, entry_id, len(meta), len(data)) + meta + data
+        with open(self.path, "r+b") as f:
+            # Drop any torn tail so the new record starts on a frame boundary
+            f.truncate(self._end)
+            f.seek(self._end)
+            f.write(frame)
+            f.flush()
+            os.fsync(f.fileno())
+        start = self._end
+        self._end += len(frame)
+        return start
+
+    def entries(self):
+        """Return [(entry_id, metadata)] for every entry, decrypting only metadata"""
+        result = []
+        with open(self.path, "rb") as f:
+            for entry_id, (meta_offset, meta_len, _, _) in self._index.items():
+                meta = self._meta.get(entry_id)
+                if meta is None:
+                    f.seek(meta_offset)
+                    blob = f.read(meta_len)
+                    meta = self._meta[entry_id] = json.loads(_open(self._aead, blob, self._aad(OP_PUT, entry_id, b"meta")))
+                result.append((entry_id.hex(), meta))
+        return result
+
+    def get(self, entry_id):
+        """Decrypt one entry and return it as an OTPAuthURI"""
+        key = bytes.fromhex(entry_id)
+        meta_offset, meta_len, data_offset, data_len = self._index[key]
+        blob = self._read(meta_offset, meta_len + data_len)
+        meta = json.loads(_open(self._aead, blob[:meta_len], self._aad(OP_PUT, key, b"meta")))
+        secret = _open(self._aead, blob[meta_len:], self._aad(OP_PUT, key, b"data")).decode("utf-8")
+        return OTPAuthURI(secret, meta["account"], meta.get("issuer"), meta["algorithm"], meta["digits"], meta["period"])
+
+    def add(self, uri):
+        """Append a credential and return its entry id"""
+        key = uuid.uuid4().bytes
+        meta = {
+            "account": uri.account,
+            "issuer": uri.issuer,
+            "algorithm": uri.algorithm,
+            "digits": uri.digits,
+            "period": uri.period,
+        }
+        meta_blob = _seal(self._aead, json.dumps(meta).encode("utf-8"), self._aad(OP_PUT, key, b"meta"))
+        data_blob = _seal(self._aead, uri.secret.encode("utf-8"), self._aad(OP_PUT, key, b"data"))
+        start = self._append(OP_PUT, key, meta_blob, data_blob)
+
+        meta_offset = start + _FRAME.size
+        self._index[key] = (meta_offset, len(meta_blob), meta_offset + len(meta_blob), len(data_blob))
+        self._meta[key] = meta
+        return key.hex()
+
+    def remove(self, entry_id):
+        """Append a tombstone for an entry"""
+        key = bytes.fromhex(entry_id)
+        if key not in self._index:
+            return
+        self._append(OP_DELETE, key, _seal(self._aead, b"", self._aad(OP_DELETE, key, b"")))
+        del self._index[key]
+        self._meta.pop(key, None)
+        self._dead += 2
+
+    def needs_compaction(self):
+        """True once superseded and deleted records outnumber live ones"""
+        return self._dead > max(len(self._index), 32)
+
+    def compact(self):
+        """Rewrite only live records to a new file and atomically replace the vault"""
+        tmp_path = f"{self.path}.tmp"
+        index = {}
+        with open(self.path, "rb") as src, open(tmp_path, "wb") as dst:
+            dst.write(self._header)
+            offset = len(self._header)
+            for key, (meta_offset, meta_len, _, data_len) in self._index.items():
+                src.seek(meta_offset)
+                # Blobs are bound to op and entry id, so they move without re-encryption
+                record = _FRAME.pack(OP_PUT, key, meta_len, data_len) + src.read(meta_len + data_len)
+                dst.write(record)
+                meta_start = offset + _FRAME.size
+                index[key] = (meta_start, meta_len, meta_start + meta_len, data_len)
+                offset += len(record)
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.replace(tmp_path, self.path)
+        # Persist the rename itself
+        dir_fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+        self._index, self._end, self._dead = index, offset, 0
+
+    def __len__(self):
+        return len(self._index)
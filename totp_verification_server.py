@@ -1,35 +1,169 @@
-from flask import Flask, request, jsonify
-import pyotp
+from flask import Flask, Response, g, request, jsonify
+import hmac
+import io
 import json
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from functools import wraps
 import time
 
+from totp_audit import create_audit_log
+from totp_cache import VerificationCache, first_match
+from totp_drift import candidate_offsets, create_drift_tracker
+from totp_enroll import import_records, read_records
+from totp_metrics import Registry
+from totp_rate_limiter import create_limiter
+from totp_replay import create_replay_guard
+from totp_store import create_store, make_credential
+
 app = Flask(__name__)
 
-# In-memory storage for demonstration (in production, use a secure database)
-secrets_store = {}
+# Upper bound on the number of (user_id, code) pairs accepted by /verify/batch
+MAX_BATCH_SIZE = 10000
+
+# Verification attempts per user_id and minute, shared by /verify and /verify/batch
+VERIFY_USER_MAX_REQUESTS = 5
+
+# Distinct codes tried for one user_id within a single /verify/batch request
+MAX_BATCH_CODES_PER_USER = 3
+
+# Per-row errors returned by /register/bulk; the rest are only counted
+MAX_REPORTED_ERRORS = 1000
+
+# /register/bulk replaces credentials wholesale, so it is disabled unless an
+# admin token is configured and must be presented as a Bearer token
+ADMIN_TOKEN = os.environ.get('TOTP_ADMIN_TOKEN')
+
+# Validation processes shared by every /register/bulk request, started on first use
+IMPORT_WORKERS = int(os.environ.get('TOTP_IMPORT_WORKERS') or min(4, os.cpu_count() or 1))
+_import_pool = None
+_import_pool_lock = threading.Lock()
+
+# Request content types accepted by /register/bulk
+BULK_FORMATS = {
+    'text/csv': 'csv',
+    'application/x-ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+    'text/uri-list': 'uri',
+    'text/plain': 'uri',
+}
+
+# Secret storage (SQLite by default, configured via TOTP_STORE_* env vars)
+secret_store = create_store()
+
+# Expected codes per user and time step, so retries in the same step skip HMAC
+verification_cache = VerificationCache()
+
+# Smoothed clock drift per user, so the most likely step is checked first
+drift_tracker = create_drift_tracker()
+
+# Last accepted step per user, so each code is accepted only once
+replay_guard = create_replay_guard()
+
+# Rate limit state (in-process by default, shared via SQLite with TOTP_RATE_LIMIT_PATH)
+limiter = create_limiter()
+
+# Behind the totp_cluster router every request comes from the router's
+# address, so per-IP limits are applied there and shards keep per-user ones
+IP_RATE_LIMITS = os.environ.get('TOTP_CLUSTER_ROLE') != 'shard'
+
+# Audit trail of register/verify outcomes (off unless TOTP_AUDIT_DIR is set)
+audit_log = create_audit_log()
 
-def rate_limit(max_requests=3, window=60):
-    """Basic rate limiting decorator"""
-    request_history = {}
-    
+# Metrics, served in Prometheus text format on /metrics
+metrics = Registry()
+REQUEST_LATENCY = metrics.histogram('totp_request_duration_seconds', 'Request latency by route', ['route'])
+OUTCOMES = metrics.counter('totp_outcomes_total', 'Request outcomes by route', ['route', 'outcome'])
+WINDOW_OFFSET = metrics.counter('totp_verify_window_offset_total', 'Time-step offset of accepted codes', ['offset'])
+DRIFT = metrics.histogram('totp_verify_drift_steps', 'Drift estimate of users with accepted codes, in time steps',
+                          buckets=(-5, -3, -2, -1, 0, 1, 2, 3, 5))
+STORE_LOOKUP = metrics.histogram('totp_store_lookup_seconds', 'Secret store lookup latency')
+metrics.gauge('totp_rate_limiter_keys', 'Keys tracked by the rate limiter', lambda: len(limiter))
+if audit_log is not None:
+    metrics.gauge('totp_audit_queue_depth', 'Audit events waiting to be written', lambda: len(audit_log))
+    metrics.gauge('totp_audit_dropped', 'Audit events dropped at the queue limit', lambda: audit_log.dropped)
+    metrics.gauge('totp_audit_sampled_out', 'Audit events skipped by sampling under backpressure', lambda: audit_log.sampled_out)
+metrics.gauge('totp_drift_tracked_users', 'Users with a non-zero drift estimate', lambda: len(drift_tracker))
+metrics.gauge('totp_verification_cache_hits', 'Verification cache hits', lambda: verification_cache.hits)
+metrics.gauge('totp_verification_cache_misses', 'Verification cache misses', lambda: verification_cache.misses)
+
+@app.before_request
+def _start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def _record_latency(response):
+    start = g.get('request_start')
+    if start is not None:
+        REQUEST_LATENCY.observe(time.perf_counter() - start, request.endpoint or 'unknown')
+    return response
+
+def _lookup_credential(user_id):
+    """Fetch a user's credential from the store, recording the lookup time"""
+    start = time.perf_counter()
+    credential = secret_store.get(user_id)
+    STORE_LOOKUP.observe(time.perf_counter() - start)
+    return credential
+
+def _outcome(route, outcome, user_id=None, offset=None, amount=1, **extra):
+    """Count a request outcome and queue its audit event"""
+    OUTCOMES.inc(route, outcome, amount=amount)
+    if audit_log is not None:
+        start = g.get('request_start')
+        audit_log.record(route, outcome, user_id=user_id, client=request.remote_addr, offset=offset,
+                         duration=time.perf_counter() - start if start is not None else None, **extra)
+
+def _credential_changed(user_id):
+    """Reset the per-user verification state tied to the previous credential"""
+    verification_cache.invalidate(user_id)
+    drift_tracker.forget(user_id)
+    replay_guard.forget(user_id)
+
+def _credentials_changed(user_ids):
+    for user_id in user_ids:
+        _credential_changed(user_id)
+
+def _record_match(route, user_id, step, now, period):
+    """Count an accepted code and fold the offset of the step it matched into the user's drift"""
+    offset = step - int(now // period)
+    _outcome(route, 'success', user_id, offset)
+    WINDOW_OFFSET.inc(str(offset))
+    drift_tracker.record(user_id, offset)
+    DRIFT.observe(drift_tracker.estimate(user_id))
+
+def _admin_authorized():
+    """Check the request's Bearer token against TOTP_ADMIN_TOKEN"""
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    return scheme.lower() == 'bearer' and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+def _get_import_pool():
+    global _import_pool
+    with _import_pool_lock:
+        if _import_pool is None:
+            _import_pool = ProcessPoolExecutor(max_workers=IMPORT_WORKERS)
+        return _import_pool
+
+def rate_limit(max_requests=3, window=60, user_max_requests=None):
+    """Rate limiting decorator, per route and client IP and optionally per user_id"""
     def decorator(f):
         @wraps(f)
         def wrapped(*args, **kwargs):
-            # Get client IP
+            # Limits are tracked separately for each route
+            route = f.__name__
             client = request.remote_addr
-            now = time.time()
-            
-            # Initialize or clean old requests
-            request_history.setdefault(client, [])
-            request_history[client] = [t for t in request_history[client] if now - t < window]
             
-            # Check rate limit
-            if len(request_history[client]) >= max_requests:
+            if IP_RATE_LIMITS and not limiter.hit(f"{route}:ip:{client}", max_requests, window):
+                _outcome(route, 'rate_limited')
                 return jsonify({"error": "Rate limit exceeded"}), 429
             
-            # Add request timestamp
-            request_history[client].append(now)
+            # Per-account limit, so distributed attempts on one user are throttled too
+            if user_max_requests is not None:
+                data = request.get_json(silent=True)
+                user_id = data.get('user_id') if isinstance(data, dict) else None
+                if user_id and not limiter.hit(f"{route}:user:{user_id}", user_max_requests, window):
+                    _outcome(route, 'rate_limited', user_id)
+                    return jsonify({"error": "Rate limit exceeded"}), 429
             
             return f(*args, **kwargs)
         return wrapped
@@ -45,23 +179,65 @@ def register():
         secret = data.get('secret')
         
         if not user_id or not secret:
+            _outcome('register', 'missing_fields', user_id)
             return jsonify({"error": "Missing required fields"}), 400
             
-        # Validate secret
+        # Validate secret and optional algorithm/digits/period
         try:
-            pyotp.TOTP(secret).now()
+            credential = make_credential(secret, data.get('algorithm'), data.get('digits'), data.get('period'))
         except Exception:
+            _outcome('register', 'invalid_secret', user_id)
             return jsonify({"error": "Invalid secret"}), 400
             
-        secrets_store[user_id] = secret
+        secret_store.put(user_id, credential)
+        _credential_changed(user_id)
+        _outcome('register', 'success', user_id)
         
         return jsonify({"message": "Registration successful"}), 201
         
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
+@app.route('/register/bulk', methods=['POST'])
+@rate_limit(max_requests=10, window=3600)
+def register_bulk():
+    """Enroll many users from a streamed CSV, NDJSON or otpauth:// URI list body"""
+    if not ADMIN_TOKEN:
+        return jsonify({"error": "Bulk registration is disabled"}), 404
+    if not _admin_authorized():
+        _outcome('register_bulk', 'unauthorized')
+        return jsonify({"error": "Unauthorized"}), 401
+
+    fmt = BULK_FORMATS.get(request.mimetype)
+    if fmt is None:
+        return jsonify({"error": f"Unsupported content type: {request.mimetype}"}), 415
+
+    try:
+        errors = []
+        def on_error(error):
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append(error)
+
+        # Read the body as a stream so large imports never sit in memory whole
+        lines = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+        pool = _get_import_pool() if IMPORT_WORKERS > 1 else None
+        summary = import_records(read_records(lines, fmt), secret_store, workers=IMPORT_WORKERS,
+                                 on_error=on_error, on_import=_credentials_changed, executor=pool)
+        OUTCOMES.inc('register_bulk', 'success', amount=summary['imported'])
+        OUTCOMES.inc('register_bulk', 'invalid_secret', amount=summary['failed'])
+        if audit_log is not None:
+            audit_log.record('register_bulk', 'completed', client=request.remote_addr,
+                             duration=time.perf_counter() - g.request_start,
+                             imported=summary['imported'], failed=summary['failed'])
+
+        summary['errors'] = errors
+        return jsonify(summary), 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
 @app.route('/verify', methods=['POST'])
-@rate_limit()
+@rate_limit(user_max_requests=VERIFY_USER_MAX_REQUESTS)
 def verify():
     """Verify a TOTP code"""
     try:
@@ -70,23 +246,143 @@ def verify():
         code = data.get('code')
         
         if not user_id or not code:
+            _outcome('verify', 'missing_fields', user_id)
             return jsonify({"error": "Missing required fields"}), 400
             
-        secret = secrets_store.get(user_id)
-        if not secret:
+        credential = _lookup_credential(user_id)
+        if not credential:
+            _outcome('verify', 'unknown_user', user_id)
             return jsonify({"error": "User not found"}), 404
             
-        # Create TOTP object
-        totp = pyotp.TOTP(secret)
-        
-        # Verify code with ±1 interval tolerance
-        if totp.verify(code, valid_window=1):
+        # Try the step predicted by the user's drift first, then widen to ±1 around it and now
+        now = time.time()
+        offsets = candidate_offsets(drift_tracker.predict(user_id))
+        step = verification_cache.match(user_id, credential, code, now, offsets)
+        if step is not None and not replay_guard.check_and_record(user_id, step):
+            _outcome('verify', 'replayed', user_id)
+            return jsonify({"error": "Code already used"}), 401
+        if step is not None:
+            _record_match('verify', user_id, step, now, credential.period)
             return jsonify({"message": "Code verified successfully"}), 200
         else:
+            _outcome('verify', 'invalid_code', user_id)
             return jsonify({"error": "Invalid code"}), 401
             
+    except Exception as e:
+        _outcome('verify', 'error')
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Expose metrics in Prometheus text format"""
+    return Response(metrics.render(), mimetype=metrics.content_type)
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """Report verification cache hit/miss counters"""
+    return jsonify(verification_cache.stats()), 200
+
+def _batch_field(value):
+    """Return a user_id or code from a batch item if it is a string or integer, else None"""
+    if isinstance(value, str) or (isinstance(value, int) and not isinstance(value, bool)):
+        return value
+    return None
+
+def _parse_batch_items():
+    """Parse a JSON or NDJSON request body into a list of (user_id, code) pairs
+
+    Fields of any other type than string or integer come back as None, so
+    the item is reported on its own instead of failing the batch.
+    """
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        items = [json.loads(line) for line in request.get_data(as_text=True).splitlines() if line.strip()]
+    else:
+        items = request.get_json()
+        if isinstance(items, dict):
+            items = items.get('items')
+        if not isinstance(items, list):
+            raise ValueError("Expected a list of items")
+
+    pairs = []
+    for item in items:
+        if isinstance(item, dict):
+            pairs.append((_batch_field(item.get('user_id')), _batch_field(item.get('code'))))
+        elif isinstance(item, (list, tuple)) and len(item) == 2:
+            pairs.append((_batch_field(item[0]), _batch_field(item[1])))
+        else:
+            pairs.append((None, None))
+    return pairs
+
+@app.route('/verify/batch', methods=['POST'])
+@rate_limit(max_requests=60)
+def verify_batch():
+    """Verify many TOTP codes in a single request"""
+    try:
+        pairs = _parse_batch_items()
+        if len(pairs) > MAX_BATCH_SIZE:
+            return jsonify({"error": f"Batch exceeds {MAX_BATCH_SIZE} items"}), 413
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
+    # Same clock for the whole batch, so codes can be shared per credential
+    now = time.time()
+    expected_codes = {}
+    totps = {}
+    codes_tried = {}
+
+    def verify_item(user_id, code):
+        if not user_id or not code:
+            _outcome('verify_batch', 'missing_fields', user_id)
+            return {"user_id": user_id, "valid": False, "error": "Missing required fields"}
+
+        # A batch is not a way around the per-user limit of /verify
+        tried = codes_tried.setdefault(user_id, set())
+        if code not in tried and len(tried) >= MAX_BATCH_CODES_PER_USER:
+            _outcome('verify_batch', 'too_many_codes', user_id)
+            return {"user_id": user_id, "valid": False, "error": "Too many codes for user"}
+        tried.add(code)
+        if not limiter.hit(f"verify:user:{user_id}", VERIFY_USER_MAX_REQUESTS, 60):
+            _outcome('verify_batch', 'rate_limited', user_id)
+            return {"user_id": user_id, "valid": False, "error": "Rate limit exceeded"}
+
+        credential = _lookup_credential(user_id)
+        if not credential:
+            _outcome('verify_batch', 'unknown_user', user_id)
+            return {"user_id": user_id, "valid": False, "error": "User not found"}
+
+        # At most one HMAC per credential and step, reused by every code sharing them
+        step = int(now // credential.period)
+        def code_at(offset):
+            key = (credential, step + offset)
+            expected = expected_codes.get(key)
+            if expected is None:
+                totp = totps.get(credential)
+                if totp is None:
+                    totp = totps[credential] = credential.totp()
+                expected = expected_codes[key] = totp.generate_otp(step + offset)
+            return expected
+
+        offset = first_match(code, candidate_offsets(drift_tracker.predict(user_id)), code_at)
+        if offset is None:
+            _outcome('verify_batch', 'invalid_code', user_id)
+            return {"user_id": user_id, "valid": False, "error": "Invalid code"}
+        matched_step = step + offset
+        if not replay_guard.check_and_record(user_id, matched_step):
+            _outcome('verify_batch', 'replayed', user_id)
+            return {"user_id": user_id, "valid": False, "error": "Code already used"}
+        _record_match('verify_batch', user_id, matched_step, now, credential.period)
+        return {"user_id": user_id, "valid": True}
+
+    # Earlier items may already be recorded as used, so a failing item is
+    # reported on its own rather than failing the whole batch
+    results = []
+    for user_id, code in pairs:
+        try:
+            results.append(verify_item(user_id, code))
+        except Exception as e:
+            _outcome('verify_batch', 'error', user_id)
+            results.append({"user_id": user_id, "valid": False, "error": str(e)})
+    return jsonify({"results": results}), 200
+
 if __name__ == "__main__":
     app.run(host='0.0.0.0', port=5000, ssl_context='adhoc')
\ No newline at end of file